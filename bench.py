@@ -0,0 +1,221 @@
+"""قياس أداء مراحل معالجة الصوت (ns لكل عينة والذاكرة المخصصة لكل كتلة)
+
+مثال:
+    python bench.py                          # تقرير فقط
+    python bench.py --save-baseline          # حفظ خط الأساس لهذا الجهاز
+    python bench.py --tolerance 0.25         # فشل (رمز خروج 1) عند تراجع أي مرحلة
+
+خط الأساس خاص بالجهاز: احفظه وقارن عليه على الجهاز نفسه.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import main
+
+CHUNK_SIZES = (1024, 2048, 4096, 8192)
+RATES = (16000, 22050, 44100)
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+
+def test_signal(frames, rate):
+    """نغمة مع ضوضاء بمستوى كلام عادي (int16)"""
+    t = np.arange(frames) / rate
+    rng = np.random.default_rng(0)
+    signal = 8000 * np.sin(2 * np.pi * 440 * t) + 500 * rng.standard_normal(frames)
+    return signal.astype(np.int16)
+
+
+def primed_suppressor(rate, frames):
+    """مزيل ضوضاء تعلّم بصمته مسبقاً حتى يُقاس مسار البوابة الكامل"""
+    suppressor = main.StreamingNoiseSuppressor(rate=rate)
+    suppressor.capture_profile(0.5)
+    rng = np.random.default_rng(1)
+    while suppressor.capture_frames_left:
+        suppressor.process(500 * rng.standard_normal(frames))
+    return suppressor
+
+
+def full_chain(rate, frames):
+    processor = main.AudioProcessor(main.ToneSource(rate=rate, frames=frames))
+    processor.configure(rate, frames, queue_size=20)
+    processor.low_pass = main.StreamingFilter(4, min(3000, rate / 2 - 1), 'low', rate)
+    processor.high_pass = main.StreamingFilter(4, 300, 'high', rate)
+    processor.noise_suppressor = primed_suppressor(rate, frames)
+    processor.volume = 0.8
+    processor.low_pass_filter = processor.high_pass_filter = True
+    processor.noise_reduction = True
+    processor.agc_enabled = processor.compressor_enabled = processor.limiter_enabled = True
+    processor.rebuild_pipeline()
+    return processor.process_audio
+
+
+# كل مرحلة: (دالة تبني المعالج لمعدل وحجم كتلة، نوع المدخل)
+STAGES = {
+    'gain': (lambda rate, frames: lambda x: main.apply_gain(x, 0.8), 'int16'),
+    'clip': (lambda rate, frames: main.clip_to_int16, 'float'),
+    'low_pass': (lambda rate, frames: main.StreamingFilter(4, 3000, 'low', rate).process, 'float'),
+    'high_pass': (lambda rate, frames: main.StreamingFilter(4, 300, 'high', rate).process, 'float'),
+    'noise': (lambda rate, frames: primed_suppressor(rate, frames).process, 'float'),
+    'agc': (lambda rate, frames: main.AutomaticGainControl(rate).process, 'float'),
+    'compressor': (lambda rate, frames: main.Compressor(rate).process, 'float'),
+    'limiter': (lambda rate, frames: main.LookaheadLimiter(rate).process, 'float'),
+    # طبقة 16kHz (نسبة غير صحيحة من 22.05/44.1kHz)، و8kHz عند التقاط 16kHz
+    'resample': (lambda rate, frames: main.StreamingResampler(rate, 16000 if rate != 16000 else 8000).process,
+                 'int16'),
+    'spectrum': (lambda rate, frames: lambda x: main.SpectrumAnalyzer().analyze(x, rate), 'int16'),
+    'chain': (full_chain, 'int16'),
+}
+for _name, _codec in main.CODECS.items():
+    STAGES[f'encode_{_name}'] = ((lambda codec: lambda rate, frames: codec.encode)(_codec), 'bytes')
+
+
+def stage_input(kind, frames, rate):
+    pcm = test_signal(frames, rate)
+    if kind == 'float':
+        return main.apply_gain(pcm, 1.0)
+    if kind == 'bytes':
+        return memoryview(pcm).cast('B')
+    return pcm
+
+
+def time_stage(func, data, min_seconds):
+    """أسرع دفعة من 5 (الأقل تأثراً بضجيج الجهاز)، بالنانوثانية لكل استدعاء"""
+    for _ in range(3):
+        func(data)
+    calls = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            func(data)
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= min_seconds * 1e9 / 5:
+            break
+        calls *= 2
+    batches = [elapsed / calls]
+    for _ in range(4):
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            func(data)
+        batches.append((time.perf_counter_ns() - start) / calls)
+    return min(batches)
+
+
+def allocated_bytes(func, data):
+    """ذروة الذاكرة المخصصة أثناء استدعاء واحد (numpy يبلّغ tracemalloc عن مصفوفاته)"""
+    func(data)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func(data)
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+
+def measure(name, rate, frames, min_seconds):
+    build, kind = STAGES[name]
+    data = stage_input(kind, frames, rate)
+    ns = time_stage(build(rate, frames), data, min_seconds)
+    allocated = allocated_bytes(build(rate, frames), data)
+    return {
+        'ns_per_sample': round(ns / frames, 3),
+        'us_per_chunk': round(ns / 1000, 2),
+        'alloc_bytes_per_chunk': allocated,
+        'budget_percent': round(100 * ns / 1e9 / (frames / rate), 3),
+    }
+
+
+def run(stages, chunk_sizes, rates, min_seconds):
+    results = {}
+    for name in stages:
+        for rate in rates:
+            for frames in chunk_sizes:
+                key = f'{name}@{rate}/{frames}'
+                result = results[key] = measure(name, rate, frames, min_seconds)
+                print(f"{key:28} {result['ns_per_sample']:9.2f} ns/sample"
+                      f" {result['us_per_chunk']:10.1f} us"
+                      f" {result['alloc_bytes_per_chunk'] / 1024:9.1f} KiB", file=sys.stderr)
+    return results
+
+
+def confirm(results, regressions, min_seconds):
+    """إعادة قياس الحالات المتراجعة مرة بزمن أطول لاستبعاد ضجيج الجهاز"""
+    for regression in regressions:
+        key = regression['stage']
+        name, rest = key.split('@')
+        rate, frames = map(int, rest.split('/'))
+        retry = measure(name, rate, frames, min_seconds * 3)
+        if retry['ns_per_sample'] < results[key]['ns_per_sample']:
+            results[key] = retry
+
+
+def compare(results, baseline, tolerance):
+    """إرجاع المراحل التي تجاوزت خط الأساس بأكثر من النسبة المسموحة"""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        limit = base['ns_per_sample'] * (1 + tolerance)
+        if result['ns_per_sample'] > limit:
+            regressions.append({'stage': key, 'baseline': base['ns_per_sample'],
+                                'current': result['ns_per_sample']})
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="قياس أداء مراحل معالجة الصوت")
+    parser.add_argument('--stages', nargs='+', choices=sorted(STAGES), default=list(STAGES))
+    parser.add_argument('--chunks', nargs='+', type=int, default=list(CHUNK_SIZES))
+    parser.add_argument('--rates', nargs='+', type=int, default=list(RATES))
+    parser.add_argument('--min-time', type=float, default=0.2, help="زمن القياس لكل حالة بالثواني")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help="نسبة التراجع المسموحة قبل الفشل (0.3 = أبطأ بـ 30%%)")
+    parser.add_argument('-o', '--output', help="ملف تقرير JSON (افتراضياً stdout)")
+    return parser.parse_args()
+
+
+def main_cli():
+    args = parse_args()
+    results = run(args.stages, args.chunks, args.rates, args.min_time)
+    report = {'numpy': np.__version__, 'results': results}
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"✅ تم حفظ خط الأساس: {args.baseline}", file=sys.stderr)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        confirm(results, compare(results, baseline, args.tolerance), args.min_time)
+        report['regressions'] = compare(results, baseline, args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    for regression in report.get('regressions', []):
+        print(f"❌ تراجع: {regression['stage']} {regression['baseline']} -> "
+              f"{regression['current']} ns/sample", file=sys.stderr)
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,238 @@
+"""اختبار حمل: N مستمع Socket.IO بلا واجهة يقيسون زمن الوصول والفجوات والإنتاجية
+
+مثال:
+    python main.py --source tone --port 5000 &
+    python loadtest.py --url http://127.0.0.1:5000 --listeners 200 --duration 60 --start -o report.json
+
+زمن الوصول = وقت الاستلام - وقت الالتقاط (ts في كل إطار)، لذا يفترض ساعة مشتركة:
+شغّله على الخادم نفسه أو على أجهزة متزامنة بـ NTP.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+try:
+    import socketio
+except ImportError:
+    socketio = None
+
+
+class Listener:
+    """مستمع واحد: ينضم، يستقبل audio_data، ويقرّ بكل إطار كما يفعل المتصفح"""
+
+    def __init__(self, index, url, codec, transports, station='main'):
+        self.index = index
+        self.url = url
+        self.codec = codec
+        self.station = station
+        self.transports = transports
+        self.client = socketio.Client(reconnection=False)
+        self.latencies = []
+        self.frames = 0
+        self.bytes = 0
+        self.gaps = 0
+        self.lost_frames = 0
+        self.last_seq = None
+        self.first_at = None
+        self.last_at = None
+        self.error = None
+        self.lock = threading.Lock()
+        self.client.on('audio_data', self.on_audio)
+
+    def on_audio(self, frame):
+        received_at = time.time()
+        seq = frame['seq']
+        with self.lock:
+            if self.last_seq is not None and seq > self.last_seq + 1:
+                self.gaps += 1
+                self.lost_frames += seq - self.last_seq - 1
+            if self.last_seq is None or seq > self.last_seq:
+                self.last_seq = seq
+            self.latencies.append(received_at - frame['ts'])
+            self.frames += 1
+            self.bytes += len(frame['data'])
+            self.first_at = self.first_at or received_at
+            self.last_at = received_at
+        return seq
+
+    def connect(self):
+        try:
+            self.client.connect(self.url, transports=self.transports)
+            self.client.emit('join_listeners', {'station': self.station, 'codec': self.codec})
+        except Exception as e:
+            self.error = str(e)
+
+    def leave(self):
+        if self.client.connected:
+            self.client.emit('leave_listeners')
+
+    def close(self):
+        if self.client.connected:
+            self.client.disconnect()
+
+    def report(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            elapsed = (self.last_at - self.first_at) if self.frames > 1 else 0
+            result = {
+                'frames': self.frames,
+                'gaps': self.gaps,
+                'lost_frames': self.lost_frames,
+                'kbps': round(self.bytes * 8 / elapsed / 1000, 1) if elapsed else 0,
+                'disconnected': not self.client.connected,
+                'error': self.error,
+            }
+        if len(latencies):
+            result.update(percentiles(latencies))
+        return result
+
+
+def percentiles(values):
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50_ms': round(p50, 1), 'p95_ms': round(p95, 1),
+            'p99_ms': round(p99, 1), 'max_ms': round(float(values.max()), 1)}
+
+
+class ProcessSampler(threading.Thread):
+    """أخذ عينات CPU و RSS لعملية الخادم من /proc (الخادم على الجهاز نفسه فقط)"""
+
+    def __init__(self, pid, interval=1.0):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+        self.ticks = os.sysconf('SC_CLK_TCK')
+
+    def cpu_seconds(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            # الحقول بعد اسم العملية (قد يحتوي مسافات) تبدأ بعد ')'
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def rss_mb(self):
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    def run(self):
+        try:
+            last_cpu, last_time = self.cpu_seconds(), time.monotonic()
+            while not self.stopped.wait(self.interval):
+                cpu, now = self.cpu_seconds(), time.monotonic()
+                self.samples.append((100 * (cpu - last_cpu) / (now - last_time), self.rss_mb()))
+                last_cpu, last_time = cpu, now
+        except OSError:
+            pass  # الخادم انتهى أو ليس على هذا الجهاز
+
+    def report(self):
+        if not self.samples:
+            return None
+        cpu, rss = np.array(self.samples).T
+        return {'cpu_percent_avg': round(float(cpu.mean()), 1),
+                'cpu_percent_max': round(float(cpu.max()), 1),
+                'rss_mb_max': round(float(rss.max()), 1),
+                'samples': len(self.samples)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="اختبار حمل لخادم الإذاعة")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--listeners', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=30.0, help="مدة القياس بالثواني")
+    parser.add_argument('--ramp', type=float, default=0.01, help="فاصل بين اتصالات المستمعين")
+    parser.add_argument('--codec', default='pcm16')
+    parser.add_argument('--station', default='main', help="المحطة التي ينضم إليها المستمعون")
+    parser.add_argument('--transport', choices=['websocket', 'polling'], default='websocket')
+    parser.add_argument('--start', action='store_true', help="إرسال start_stream قبل القياس")
+    parser.add_argument('--pid', type=int, help="pid الخادم (افتراضياً من /status)")
+    parser.add_argument('--per-listener', action='store_true', help="تضمين تفاصيل كل مستمع")
+    parser.add_argument('-o', '--output', help="ملف تقرير JSON (افتراضياً stdout)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if socketio is None:
+        print("❌ مكتبة مفقودة: python-socketio", file=sys.stderr)
+        print('💡 pip install "python-socketio[client]"', file=sys.stderr)
+        return 1
+
+    server = requests.get(f'{args.url}/status', timeout=5).json()
+    pid = args.pid or server.get('pid')
+    sampler = None
+    if pid and os.path.exists(f'/proc/{pid}'):
+        sampler = ProcessSampler(pid)
+        sampler.start()
+
+    if args.start:
+        control = socketio.Client(reconnection=False)
+        control.connect(args.url, transports=[args.transport])
+        control.emit('start_stream', {'station': args.station})
+        time.sleep(0.5)
+        control.disconnect()
+
+    print(f"🔌 اتصال {args.listeners} مستمع بـ {args.url} ...", file=sys.stderr)
+    clients = []
+    connect_started = time.monotonic()
+    for i in range(args.listeners):
+        listener = Listener(i, args.url, args.codec, [args.transport], args.station)
+        listener.connect()
+        clients.append(listener)
+        time.sleep(args.ramp)
+    connect_seconds = time.monotonic() - connect_started
+
+    print(f"⏱️ القياس لمدة {args.duration} ثانية ...", file=sys.stderr)
+    time.sleep(args.duration)
+
+    reports = [listener.report() for listener in clients]
+    for listener in clients:
+        listener.leave()
+    time.sleep(0.5)  # إطارات في الطريق قبل قطع الاتصال
+    for listener in clients:
+        listener.close()
+    if sampler:
+        sampler.stopped.set()
+
+    all_latencies = np.concatenate([np.array(l.latencies) for l in clients]) * 1000
+    p95s = np.array([r['p95_ms'] for r in reports if 'p95_ms' in r])
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'url': args.url,
+        'server_config': server.get('config'),
+        'params': {'listeners': args.listeners, 'duration': args.duration,
+                   'codec': args.codec, 'transport': args.transport, 'station': args.station},
+        'connect_seconds': round(connect_seconds, 2),
+        'connected': sum(1 for r in reports if not r['error']),
+        'receiving': sum(1 for r in reports if r['frames']),
+        'frames': sum(r['frames'] for r in reports),
+        'gaps': sum(r['gaps'] for r in reports),
+        'lost_frames': sum(r['lost_frames'] for r in reports),
+        'kbps_per_listener': round(float(np.mean([r['kbps'] for r in reports])), 1) if reports else 0,
+        'latency': percentiles(all_latencies) if len(all_latencies) else None,
+        'listener_p95_ms': percentiles(p95s) if len(p95s) else None,
+        'server': sampler.report() if sampler else None,
+    }
+    if args.per_listener:
+        report['per_listener'] = reports
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f"✅ التقرير: {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
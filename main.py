@@ -6,176 +6,2136 @@
 تطبيق بث صوتي مع واجهة ويب وتحكم كامل في الصوت
 """
 
+import os
+
+# وضع الخادم: threading (افتراضي) أو eventlet لآلاف المستمعين المتزامنين
+# يجب أن يتم الترقيع قبل استيراد أي مكتبة أخرى
+ASYNC_MODE = os.environ.get('RADIO_ASYNC_MODE', 'threading')
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
 import threading
 import socket
-import pyaudio
 import wave
 import time
 import json
-import base64
-import os
+import math
+import io
 import sys
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
 import queue  # إضافة هذا الاستيراد
+import struct
+import bisect
+import functools
+import hashlib
+import heapq
+import itertools
 from datetime import datetime
-from collections import deque  # إضافة هذا الاستيراد
-from flask import Flask, render_template_string, request, jsonify, Response
-from flask_socketio import SocketIO, emit
+from collections import deque, namedtuple, OrderedDict  # إضافة هذا الاستيراد
+from flask import Flask, render_template_string, request, jsonify, Response, has_request_context
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import numpy as np
-from scipy.signal import butter, filtfilt
-import noisereduce as nr
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import minimum_filter1d
+from scipy.signal import butter, sosfilt, sosfilt_zi, lfilter, lfilter_zi, resample_poly, firwin
 import requests
 
+try:
+    import pyaudio
+except ImportError:  # المصادر الأخرى (ملف، مولد، أنبوب) لا تحتاج بطاقة صوت
+    pyaudio = None
+
+if ASYNC_MODE == 'eventlet':
+    from eventlet import patcher, tpool
+    # callback الصوت يعمل في خيط PortAudio حقيقي، فأدوات التسليم بينه وبين
+    # الخادم يجب أن تكون أقفال النظام الأصلية لا الخضراء
+    native_threading = patcher.original('threading')
+    native_queue = patcher.original('queue')
+
+    def run_blocking(func, *args):
+        """تنفيذ انتظار حاجب في خيط نظام حقيقي دون إيقاف حلقة الأحداث"""
+        return tpool.execute(func, *args)
+else:
+    native_threading = threading
+    native_queue = queue
+
+    def run_blocking(func, *args):
+        return func(*args)
+
 # إعدادات الصوت
 # تحديث الإعدادات لتحسين الأداء
 CHUNK = 4096  # زيادة حجم البفر
-FORMAT = pyaudio.paInt16
+SAMPLE_WIDTH = 2  # int16
 CHANNELS = 1
 RATE = 22050  # تقليل معدل العينة لتحسين الأداء
 RECORD_SECONDS = 0.1
+RING_SECONDS = 5.0       # مدة الصوت الأخير المحفوظ في الحلقة المشتركة
+PREBUFFER_SECONDS = 0.5  # الدفعة الأولية التي تُرسل للمستمع عند انضمامه
+# ملفات زمن الوصول: حجم الكتلة والمعدل وأعماق الطوابير تتغير معاً
+LATENCY_PROFILES = {
+    # كتل 32ms للحديث المباشر: رسائل أكثر وطوابير أعمق بعدد الكتل
+    'talkback': {'chunk': 512, 'rate': 16000, 'queue': 40, 'listener_queue': 24,
+                 'send_window': 8, 'prebuffer': 0.1},
+    'default': {'chunk': CHUNK, 'rate': RATE, 'queue': 20, 'listener_queue': 10,
+                'send_window': 4, 'prebuffer': PREBUFFER_SECONDS},
+    # كتل 0.75s: أقل عدد رسائل لكل مستمع على حساب التأخير
+    'throughput': {'chunk': 16384, 'rate': 22050, 'queue': 6, 'listener_queue': 4,
+                   'send_window': 2, 'prebuffer': 1.5},
+    # التقاط بجودة 44.1kHz يفتح كل طبقات الجودة
+    'studio': {'chunk': 8192, 'rate': 44100, 'queue': 20, 'listener_queue': 10,
+               'send_window': 4, 'prebuffer': 0.5},
+}
+DEFAULT_LATENCY_PROFILE = 'default'
+TIER_RATES = (8000, 16000, 22050, 44100)  # طبقات الجودة المتاحة حتى معدل الالتقاط
+HLS_SEGMENT_SECONDS = 4.0   # مدة مقطع HLS (الحدود على شبكة زمنية ثابتة)
+HLS_CACHED_SEGMENTS = 10    # عدد المقاطع المحفوظة في الذاكرة
+HLS_PLAYLIST_SEGMENTS = 5   # عدد المقاطع المعلنة في قائمة التشغيل
+MAIN_STATION = 'main'       # المحطة الافتراضية (/ و /listen و /status)
+FANOUT_WORKERS = 4          # عمال التوزيع المشتركون بين كل المحطات
+SPECTRUM_BANDS = 50         # أعمدة مصور الطيف في لوحة التحكم
+SPECTRUM_RATE_HZ = 12       # أقصى عدد إطارات الطيف في الثانية
+SPECTRUM_MIN_HZ = 40.0      # بداية النطاقات اللوغاريتمية
+SPECTRUM_FLOOR_DB = -80.0   # المستوى المقابل للصفر في قيم uint8
 
-class AudioProcessor:
+class Metric:
+    """مقياس بنمط Prometheus مع تسمية (label) اختيارية واحدة
+
+    يُحدَّث من خيوط الالتقاط وعمال التوزيع معاً، لذا يحمي قفلٌ أصلي قصير
+    كل قراءة-تعديل-كتابة (نادراً ما يُتنافس عليه).
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.lock = native_threading.Lock()
+
+    def _labels(self, label_value, extra=''):
+        parts = []
+        if self.label is not None and label_value is not None:
+            parts.append(f'{self.label}="{label_value}"')
+        if extra:
+            parts.append(extra)
+        return '{' + ','.join(parts) + '}' if parts else ''
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label=None):
+        super().__init__(name, help_text, label)
+        self.values = {}
+
+    def inc(self, label_value=None, amount=1):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        return [f"{self.name}{self._labels(key)} {value}" for key, value in values]
+
+class Gauge(Metric):
+    """مقياس لحظي يُقرأ من دالة عند الطلب فقط، فلا كلفة له في المسار الحرج"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, read):
+        super().__init__(name, help_text)
+        self.read = read
+
+    def samples(self):
+        return [f"{self.name} {self.read()}"]
+
+class Histogram(Metric):
+    kind = 'histogram'
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+               0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, name, help_text, label=None, buckets=BUCKETS):
+        super().__init__(name, help_text, label)
+        self.buckets = buckets
+        self.series = {}  # قيمة التسمية -> [عدادات الحاويات..., المجموع]
+
+    def observe(self, value, label_value=None):
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += value
+
+    def samples(self):
+        # نسخة متسقة: عدد الحاويات والمجموع من اللحظة نفسها
+        with self.lock:
+            snapshot = [(key, list(series)) for key, series in self.series.items()]
+        lines = []
+        for key, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{self._labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {series[-1]}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
     def __init__(self):
-        self.audio = pyaudio.PyAudio()
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label=None):
+        return self.register(Counter(name, help_text, label))
+
+    def gauge(self, name, help_text, read):
+        return self.register(Gauge(name, help_text, read))
+
+    def histogram(self, name, help_text, label=None):
+        return self.register(Histogram(name, help_text, label))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+# مقاييس الأداء، تُعرض على /metrics
+metrics = MetricsRegistry()
+callback_seconds = metrics.histogram('radio_callback_seconds', "زمن معالجة كتلة داخل callback الصوت")
+queue_wait_seconds = metrics.histogram('radio_queue_wait_seconds', "زمن انتظار الكتلة في الطابور حتى خيط البث")
+encode_seconds = metrics.histogram('radio_encode_seconds', "زمن ترميز كتلة لكل ترميز", label='codec')
+emit_seconds = metrics.histogram('radio_emit_seconds', "زمن دفع كتلة إلى طوابير كل المستمعين")
+chunks_dropped = metrics.counter('radio_chunks_dropped_total', "كتل أُسقطت لأن طابور البث ممتلئ")
+input_overflows = metrics.counter('radio_input_overflows_total', "فيض مدخل بطاقة الصوت (PortAudio)")
+player_underruns = metrics.counter('radio_player_underruns_total', "نفاد الصوت لدى مشغلات المستمعين")
+listener_frames_dropped = metrics.counter('radio_listener_frames_dropped_total',
+                                          "إطارات أسقطتها طوابير المستمعين البطيئين", label='policy')
+socket_events = metrics.counter('radio_socket_events_total', "أحداث Socket.IO المستلمة حسب النوع", label='event')
+socket_emits = metrics.counter('radio_socket_emits_total', "أحداث Socket.IO المرسلة حسب النوع", label='event')
+archive_chunks_dropped = metrics.counter('radio_archive_chunks_dropped_total',
+                                         "كتل لم تُؤرشف لأن طابور الكتابة ممتلئ (قرص بطيء)")
+dsp_stage_seconds = metrics.histogram('radio_dsp_stage_seconds', "زمن كل مرحلة معالجة لكل كتلة",
+                                      label='stage')
+dsp_stage_errors = metrics.counter('radio_dsp_stage_errors_total', "أخطاء مراحل المعالجة (تُتجاوز المرحلة)",
+                                   label='stage')
+
+def apply_gain(data, volume):
+    """تطبيق مستوى الصوت على كتلة int16 بدقة float32 (نصف ذاكرة float64 وتكفي 16 بت)"""
+    return np.multiply(data, np.float32(volume), dtype=np.float32)
+
+def clip_to_int16(data):
+    """قص العينات إلى مدى int16 في المكان نفسه ثم تحويلها (المصفوفة مؤقتة دائماً)"""
+    np.clip(data, -32767, 32767, out=data)
+    return data.astype(np.int16)
+
+class GainStage:
+    """مستوى الصوت: int16 إلى float32 مضروباً في الكسب"""
+    def __init__(self, volume):
+        self.volume = volume
+
+    def process(self, data):
+        return apply_gain(data, self.volume)
+
+class MuteStage:
+    """الكتم: السلسلة كلها تصبح هذه المرحلة فلا تتقدم حالة المرشحات أثناءه"""
+    def process(self, data):
+        return np.zeros(len(data), dtype=np.float32)
+
+class NoiseProfileTap:
+    """تحليل فقط: يغذي التقاط بصمة الضوضاء بالكتلة بعد الكسب ويمررها كما هي
+
+    يدخل السلسلة أثناء الالتقاط حين تكون البوابة معطلة أو الصوت مكتوماً،
+    فالبصمة تُلتقط من الميكروفون في كل الحالات.
+    """
+    def __init__(self, suppressor, volume):
+        self.suppressor = suppressor
+        self.volume = volume
+
+    def process(self, data):
+        if self.suppressor.capture_frames_left:
+            self.suppressor.observe(apply_gain(data, self.volume))
+        return data
+
+class StageTiming:
+    """زمن وأخطاء مرحلة واحدة؛ تبقى بين إعادات بناء السلسلة"""
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.last_error = None
+        self.avg_ms = 0.0
+        self.max_ms = 0.0
+        self.chunk_ms = 0.0
+
+    def observe(self, seconds, chunk_seconds):
+        elapsed_ms = seconds * 1000
+        self.calls += 1
+        self.avg_ms = elapsed_ms if self.calls == 1 else self.avg_ms * 0.95 + elapsed_ms * 0.05
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.chunk_ms = chunk_seconds * 1000
+        dsp_stage_seconds.observe(seconds, self.name)
+
+    def error(self, exc):
+        self.errors += 1
+        dsp_stage_errors.inc(self.name)
+        if str(exc) != self.last_error:
+            # طباعة الخطأ عند تغيّره فقط: المرحلة المعطوبة تفشل مع كل كتلة
+            print(f"خطأ في مرحلة المعالجة {self.name}: {exc}")
+        self.last_error = str(exc)
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'avg_ms': round(self.avg_ms, 3),
+            'max_ms': round(self.max_ms, 3),
+            'budget_percent': round(100 * self.avg_ms / self.chunk_ms, 2) if self.chunk_ms else 0.0,
+        }
+
+class DspPipeline:
+    """سلسلة مراحل مرتبة بواجهة process(buf) موحدة
+
+    تُجمَّع مرة واحدة عند أحداث التحكم وتُستبدل كاملة، فلا أعلام تُفحص مع كل كتلة.
+    المرحلة التي ترفع استثناءً تُتجاوز (تمر الكتلة كما هي) ويُسجَّل خطؤها في توقيتها.
+    """
+    def __init__(self, stages=(), rate=RATE, timings=None):
+        timings = {} if timings is None else timings
+        for name, _ in stages:
+            if name not in timings:
+                timings[name] = StageTiming(name)
+        self.rate = rate
+        self.stages = tuple((name, stage, timings[name]) for name, stage in stages)
+
+    @property
+    def names(self):
+        return [name for name, _, _ in self.stages]
+
+    def process(self, data):
+        chunk_seconds = len(data) / self.rate
+        for _, stage, timing in self.stages:
+            started = time.perf_counter()
+            try:
+                data = stage.process(data)
+            except Exception as e:
+                timing.error(e)
+            timing.observe(time.perf_counter() - started, chunk_seconds)
+        return data
+
+class StreamingFilter:
+    """مرشح IIR سببي متدفق: معاملات SOS تُصمَّم مرة واحدة والحالة تنتقل بين الكتل"""
+    def __init__(self, order, cutoff, btype, rate=RATE):
+        self.sos = butter(order, cutoff, btype=btype, fs=rate, output='sos')
+        self.zi = None
+
+    def reset(self):
+        # تُهيأ الحالة من أول عينة في الكتلة التالية لتجنب قفزة البداية
+        self.zi = None
+
+    def process(self, data):
+        if self.zi is None:
+            self.zi = sosfilt_zi(self.sos) * (data[0] if len(data) else 0.0)
+        out, self.zi = sosfilt(self.sos, data, zi=self.zi)
+        return out
+
+def dbfs(level_db):
+    """مستوى بالديسيبل نسبة للمدى الكامل إلى سعة بوحدات int16"""
+    return 32768.0 * 10 ** (level_db / 20)
+
+def one_pole(seconds, rate):
+    """معاملات lfilter لمنعّم أسي أحادي القطب بثابت زمني seconds"""
+    decay = math.exp(-1.0 / (seconds * rate))
+    return np.array([1.0 - decay]), np.array([1.0, -decay])
+
+class AutomaticGainControl:
+    """تحكم آلي بالكسب: غلاف RMS بطيء يقود الكسب نحو مستوى هدف، ويثبت الكسب أثناء الصمت"""
+
+    def __init__(self, rate=RATE, target_db=-20.0, max_gain_db=18.0, min_gain_db=-12.0,
+                 gate_db=-55.0, window=1.0, smoothing=0.3):
+        self.target = dbfs(target_db)
+        self.max_gain = 10 ** (max_gain_db / 20)
+        self.min_gain = 10 ** (min_gain_db / 20)
+        self.gate = dbfs(gate_db)
+        self.env_b, self.env_a = one_pole(window, rate)
+        self.gain_b, self.gain_a = one_pole(smoothing, rate)
+        self.reset()
+
+    def reset(self):
+        self.env_zi = None
+        self.gain_zi = None
+        self.gain = 1.0
+
+    def process(self, data):
+        if not len(data):
+            return data
+        power = data * data
+        if self.env_zi is None:
+            # الغلاف يبدأ من طاقة أول كتلة بدل الصفر حتى لا يقفز الكسب إلى أقصاه
+            self.env_zi = lfilter_zi(self.env_b, self.env_a) * np.mean(power)
+            self.gain_zi = lfilter_zi(self.gain_b, self.gain_a) * self.gain
+        envelope, self.env_zi = lfilter(self.env_b, self.env_a, power, zi=self.env_zi)
+        rms = np.sqrt(envelope)
+        target = np.clip(self.target / np.maximum(rms, 1e-9), self.min_gain, self.max_gain)
+        # تحت بوابة الصمت يبقى الكسب الحالي حتى لا تُضخَّم الضوضاء
+        target = np.where(rms < self.gate, self.gain, target)
+        gain, self.gain_zi = lfilter(self.gain_b, self.gain_a, target, zi=self.gain_zi)
+        self.gain = float(gain[-1])
+        return data * gain
+
+    def stats(self):
+        return {'gain_db': round(20 * math.log10(self.gain), 2)}
+
+class Compressor:
+    """ضاغط: غلاف RMS قصير ومنحنى كسب ثابت بالديسيبل ثم تنعيم خفض الكسب (زمن التحرير)"""
+
+    def __init__(self, rate=RATE, threshold_db=-18.0, ratio=3.0, makeup_db=4.0,
+                 detector=0.01, release=0.1):
+        self.threshold_db = threshold_db
+        self.slope = 1.0 - 1.0 / ratio
+        self.makeup = 10 ** (makeup_db / 20)
+        self.env_b, self.env_a = one_pole(detector, rate)
+        self.gain_b, self.gain_a = one_pole(release, rate)
+        self.reset()
+
+    def reset(self):
+        self.env_zi = None
+        self.gain_zi = lfilter_zi(self.gain_b, self.gain_a)
+        self.reduction_db = 0.0
+
+    def process(self, data):
+        if not len(data):
+            return data
+        power = data * data
+        if self.env_zi is None:
+            self.env_zi = lfilter_zi(self.env_b, self.env_a) * np.mean(power)
+        envelope, self.env_zi = lfilter(self.env_b, self.env_a, power, zi=self.env_zi)
+        level_db = 10 * np.log10(envelope / 32768.0 ** 2 + 1e-12)
+        reduction_db = -self.slope * np.maximum(level_db - self.threshold_db, 0.0)
+        gain, self.gain_zi = lfilter(self.gain_b, self.gain_a, 10 ** (reduction_db / 20),
+                                     zi=self.gain_zi)
+        self.reduction_db = 20 * math.log10(max(float(gain.min()), 1e-6))
+        return data * (gain * self.makeup)
+
+    def stats(self):
+        return {'reduction_db': round(self.reduction_db, 2)}
+
+class LookaheadLimiter:
+    """محدد بنظرة مسبقة: الصوت يتأخر lookahead ثانية فيبدأ خفض الكسب قبل القمة ولا تتجاوز العتبة
+
+    الكسب المطلوب لكل عينة -> أدنى قيمة على نافذة النظرة المسبقة -> متوسط متحرك بطول
+    النافذة نفسها (هبوط سلس يبلغ المطلوب عند القمة تماماً) -> تحرير بمنعّم أسي لا يتجاوز
+    الكسب المطلوب. كل المراحل متجهة، وحالتها (العينات المؤخرة وحالة المرشحات) تنتقل بين الكتل.
+    """
+
+    def __init__(self, rate=RATE, threshold_db=-1.0, lookahead=0.005, release=0.05):
+        self.rate = rate
+        self.threshold = dbfs(threshold_db)
+        self.delay = 2 * max(1, round(lookahead * rate / 2))  # زوجي: نافذة الأدنى متمركزة
+        self.release_b, self.release_a = one_pole(release, rate)
+        self.reset()
+
+    def reset(self):
+        self.pending = np.zeros(self.delay)   # آخر عينات الإدخال التي لم تخرج بعد
+        self.required = np.ones(self.delay)   # الكسب المطلوب لها
+        self.held = np.ones(self.delay)       # آخر قيم الأدنى لنافذة المتوسط المتحرك
+        self.release_zi = lfilter_zi(self.release_b, self.release_a)
+        self.reduction_db = 0.0
+
+    def process(self, data):
+        count = len(data)
+        if not count:
+            return data
+        required = np.concatenate((
+            self.required, np.minimum(1.0, self.threshold / np.maximum(np.abs(data), 1e-9))))
+        # الأدنى على [k, k + delay]: المرشح المتمركز مزاح بنصف النافذة
+        half = self.delay // 2
+        held = minimum_filter1d(required, self.delay + 1)[half:half + count]
+        # متوسط متحرك بالمجاميع التراكمية بدل مرشح FIR بطول النافذة
+        sums = np.cumsum(np.concatenate(([0.0], self.held, held)))
+        smooth = (sums[self.delay + 1:] - sums[:count]) / (self.delay + 1)
+        self.held = np.concatenate((self.held, held))[count:]
+        released, self.release_zi = lfilter(self.release_b, self.release_a, smooth,
+                                            zi=self.release_zi)
+        gain = np.minimum(smooth, released)
+        delayed = np.concatenate((self.pending, data))
+        self.pending = delayed[count:]
+        self.required = required[count:]
+        self.reduction_db = 20 * math.log10(max(float(gain.min()), 1e-6))
+        return delayed[:count] * gain
+
+    def stats(self):
+        return {'reduction_db': round(self.reduction_db, 2),
+                'delay_ms': round(1000 * self.delay / self.rate, 2)}
+
+@functools.lru_cache(maxsize=None)
+def polyphase_filter(up, down):
+    """مرشح تمرير منخفض بتصميم resample_poly مقسوماً إلى أطوار: الصف p معاملات الطور p معكوسة"""
+    if up == down:
+        return np.ones((1, 1))  # المعدل نفسه: تمرير مباشر
+    half_len = 10 * max(up, down)
+    h = firwin(2 * half_len + 1, 1.0 / max(up, down), window=('kaiser', 5.0)) * up
+    taps = -(-len(h) // up)
+    h = np.concatenate((h, np.zeros(taps * up - len(h))))
+    return h.reshape(taps, up).T[:, ::-1].copy()
+
+class StreamingResampler:
+    """تغيير معدل العينة متعدد الأطوار ومتدفق: آخر عينات الإدخال وموضع الطور تنتقل بين الكتل
+
+    يعادل upfirdn لمرشح resample_poly على الإشارة كاملة (بتأخير المرشح الثابت)،
+    وكل عينة خرج ضرب نقطي واحد بطول أطوار المرشح لا بطوله الكامل.
+    """
+    BLOCK = 1024
+
+    def __init__(self, from_rate, to_rate):
+        divisor = math.gcd(from_rate, to_rate)
+        self.up, self.down = to_rate // divisor, from_rate // divisor
+        self.phases = polyphase_filter(self.up, self.down)
+        self.taps = self.phases.shape[1]
+        self.reset()
+
+    def reset(self):
+        self.history = np.zeros(self.taps - 1)
+        self.offset = 0  # موضع عينة الخرج التالية (بوحدات المعدل المرفوع) من بداية الكتلة التالية
+
+    def process(self, data):
+        if not len(data):
+            return np.zeros(0)
+        buf = np.concatenate((self.history, data))
+        limit = len(data) * self.up
+        times = np.arange(self.offset, limit, self.down)
+        base, phase = np.divmod(times, self.up)
+        windows = sliding_window_view(buf, self.taps)
+        out = np.empty(len(times))
+        # كتل من المخرجات حتى تبقى النوافذ المجمّعة صغيرة وداخل الذاكرة المخبئية
+        for start in range(0, len(times), self.BLOCK):
+            rows = slice(start, start + self.BLOCK)
+            out[rows] = np.einsum('ij,ij->i', windows[base[rows]], self.phases[phase[rows]])
+        self.offset = (times[-1] + self.down if len(times) else self.offset) - limit
+        self.history = buf[len(buf) - (self.taps - 1):]
+        return out
+
+@functools.lru_cache(maxsize=16)
+def spectrum_band_map(frames, rate, bands):
+    """خريطة ثابتة من خانات rfft إلى نطاقات لوغاريتمية لكل (حجم كتلة، معدل)
+
+    تُرجع نافذة هان، ونطاق كل خانة، وعدد خانات كل نطاق، وأقرب خانة لمركز كل نطاق
+    (للنطاقات المنخفضة الأضيق من دقة التحويل).
+    """
+    freqs = np.fft.rfftfreq(frames, 1.0 / rate)
+    edges = np.geomspace(SPECTRUM_MIN_HZ, rate / 2, bands + 1)
+    band_of_bin = np.minimum(np.searchsorted(edges, freqs, side='right') - 1, bands - 1)
+    bins = np.flatnonzero(band_of_bin >= 0)
+    counts = np.bincount(band_of_bin[bins], minlength=bands)
+    centers = np.sqrt(edges[:-1] * edges[1:])
+    nearest = np.minimum(np.rint(centers * frames / rate).astype(int), len(freqs) - 1)
+    return np.hanning(frames).astype(np.float32), bins, band_of_bin[bins], counts, nearest
+
+class SpectrumAnalyzer:
+    """مستويات نطاقات لوغاريتمية (uint8) لمصور لوحة التحكم: rfft واحد لكل كتلة بحد أقصى rate_hz"""
+
+    def __init__(self, bands=SPECTRUM_BANDS, rate_hz=SPECTRUM_RATE_HZ):
+        self.bands = bands
+        self.interval = 1.0 / rate_hz
+        self.last = 0.0
+
+    def due(self, now):
+        """هل حان موعد إطار جديد؟ يحجز الموعد عند الإيجاب"""
+        if now - self.last < self.interval:
+            return False
+        self.last = now
+        return True
+
+    def analyze(self, samples, rate):
+        window, bins, band_of_bin, counts, nearest = spectrum_band_map(len(samples), rate, self.bands)
+        spectrum = np.fft.rfft(samples * window)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        energy = np.bincount(band_of_bin, weights=power[bins], minlength=self.bands)
+        energy = np.where(counts > 0, energy, power[nearest])
+        # 0 dB = موجة جيبية بكامل مدى int16 (قمة هان = N/4 من السعة)
+        scale = 16.0 / (len(samples) * 32768.0) ** 2
+        level_db = 10 * np.log10(energy * scale + 1e-12)
+        levels = (level_db - SPECTRUM_FLOOR_DB) * (255.0 / -SPECTRUM_FLOOR_DB)
+        return np.clip(levels, 0, 255).astype(np.uint8)
+
+class StreamingNoiseSuppressor:
+    """مزيل ضوضاء متدفق بالبوابة الطيفية: STFT بتراكب وجمع وحالة محمولة بين الكتل"""
+    def __init__(self, rate=RATE, frame_size=512, threshold=1.5, floor=0.1,
+                 smoothing=0.6, profile_decay=0.9):
+        self.rate = rate
+        self.frame_size = frame_size
+        self.hop = frame_size // 2
+        # نافذة جذر هان الدورية للتحليل والتركيب: مجموع مربعاتها بتداخل 50% يساوي 1
+        n = np.arange(frame_size)
+        self.window = np.sqrt(0.5 - 0.5 * np.cos(2 * np.pi * n / frame_size))
+        self.threshold = threshold
+        self.floor = floor
+        self.profile_decay = profile_decay
+        # تنعيم الكسب عبر الزمن لتقليل "الضوضاء الموسيقية"
+        self._smooth_b = np.array([1.0 - smoothing])
+        self._smooth_a = np.array([1.0, -smoothing])
+        self.noise_profile = None
+        self.capture_frames_left = 0
+        # قياس كلفة المعالجة لكل كتلة مقارنة بمدتها الزمنية
+        self.last_ms = 0.0
+        self.avg_ms = 0.0
+        self.max_ms = 0.0
+        self.budget = 0.0
+        self.chunks = 0
+        self.reset()
+
+    def reset(self):
+        # تعبئة أولية بإطار ناقص قفزة واحدة تجعل طول المخرج مساوياً لطول المدخل
+        self._pending = np.zeros(self.frame_size - self.hop)
+        self._ola_tail = np.zeros(self.hop)
+        self._gain_zi = None
+        self._analysis_pending = np.zeros(0)
+
+    def capture_profile(self, seconds=1.0):
+        """تعلّم بصمة الضوضاء من الإطارات القادمة خلال المدة المحددة"""
+        self.capture_frames_left = max(1, int(seconds * self.rate / self.hop))
+
+    def _learn_profile(self, mags):
+        count = min(self.capture_frames_left, len(mags))
+        if count <= 0:
+            return
+        frame_mean = mags[:count].mean(axis=0)
+        if self.noise_profile is None:
+            self.noise_profile = frame_mean
+        else:
+            # تحديث تدريجي للبصمة بدلاً من إعادة تقديرها من الصفر
+            self.noise_profile = (self.profile_decay * self.noise_profile
+                                  + (1.0 - self.profile_decay) * frame_mean)
+        self.capture_frames_left -= count
+
+    def observe(self, data):
+        """تعلّم البصمة من الكتلة دون تعديلها (حين تكون البوابة خارج السلسلة)"""
+        if not self.capture_frames_left:
+            self._analysis_pending = np.zeros(0)
+            return
+        frame_size, hop = self.frame_size, self.hop
+        buf = np.concatenate((self._analysis_pending, data))
+        n_frames = (len(buf) - frame_size) // hop + 1 if len(buf) >= frame_size else 0
+        if n_frames > 0:
+            frames = sliding_window_view(buf, frame_size)[::hop][:n_frames] * self.window
+            self._learn_profile(np.abs(np.fft.rfft(frames, axis=1)))
+            buf = buf[n_frames * hop:]
+        self._analysis_pending = buf
+
+    def process(self, data):
+        start = time.perf_counter()
+        frame_size, hop = self.frame_size, self.hop
+        buf = np.concatenate((self._pending, data))
+        n_frames = (len(buf) - frame_size) // hop + 1 if len(buf) >= frame_size else 0
+        if n_frames <= 0:
+            self._pending = buf
+            return np.zeros(0)
+
+        frames = sliding_window_view(buf, frame_size)[::hop][:n_frames] * self.window
+        spectrum = np.fft.rfft(frames, axis=1)
+        mags = np.abs(spectrum)
+
+        if self.capture_frames_left:
+            self._learn_profile(mags)
+
+        if self.noise_profile is not None:
+            gain = 1.0 - self.threshold * self.noise_profile / (mags + 1e-9)
+            np.clip(gain, self.floor, 1.0, out=gain)
+            if self._gain_zi is None:
+                self._gain_zi = lfilter_zi(self._smooth_b, self._smooth_a)[:, None] * gain[:1]
+            gain, self._gain_zi = lfilter(self._smooth_b, self._smooth_a, gain,
+                                          axis=0, zi=self._gain_zi)
+            spectrum *= gain
+
+        frames_out = np.fft.irfft(spectrum, n=frame_size, axis=1) * self.window
+        # تراكب وجمع: النصف الأول لكل إطار + النصف الثاني للإطار السابق
+        out = frames_out[:, :hop].copy()
+        out[0] += self._ola_tail
+        out[1:] += frames_out[:-1, hop:]
+        self._ola_tail = frames_out[-1, hop:].copy()
+        self._pending = buf[n_frames * hop:]
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.chunks += 1
+        self.last_ms = elapsed_ms
+        self.avg_ms += (elapsed_ms - self.avg_ms) / min(self.chunks, 100)
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.budget = elapsed_ms / (len(data) * 1000.0 / self.rate) if len(data) else 0.0
+        return out.ravel()
+
+    def stats(self):
+        return {
+            'profile_ready': self.noise_profile is not None,
+            'capturing_profile': self.capture_frames_left > 0,
+            'last_ms': round(self.last_ms, 3),
+            'avg_ms': round(self.avg_ms, 3),
+            'max_ms': round(self.max_ms, 3),
+            'budget_percent': round(self.budget * 100, 2),
+        }
+
+class BroadcastRing:
+    """حلقة مشتركة مخصصة مسبقاً لآخر الصوت المعالج
+
+    كل كتلة تُكتب مرة واحدة وبشكل متصل (لا تلتف عبر نهاية الحلقة)، لذا
+    تُقرأ كشريحة memoryview واحدة دون نسخ مهما كان عدد المستمعين.
+    الشرائح صالحة حتى تدور الحلقة عليها (RING_SECONDS تقريباً).
+    """
+    def __init__(self, seconds=RING_SECONDS, rate=RATE, sample_width=2):
+        self.capacity = int(seconds * rate) * sample_width
+        self.buffer = bytearray(self.capacity)
+        self.view = memoryview(self.buffer)
+        self.chunks = deque()  # (seq, وقت الالتقاط, موضع البداية, الطول)
+        self.write_offset = 0
+        self.seq = 0
+        self.lock = native_threading.Lock()
+
+    def write(self, data, captured_at):
+        """نسخ الكتلة إلى الحلقة، ويعيد (seq، شريحة الكتلة داخل الحلقة)"""
+        data = memoryview(data).cast('B')
+        length = min(len(data), self.capacity)
+        with self.lock:
+            start = self.write_offset if self.write_offset + length <= self.capacity else 0
+            end = start + length
+            # إخلاء الكتل التي ستُكتب فوقها قبل الكتابة
+            while self.chunks and self._overlaps(self.chunks[0], start, end):
+                self.chunks.popleft()
+        self.view[start:end] = data[len(data) - length:]
+        with self.lock:
+            self.seq += 1
+            self.chunks.append((self.seq, captured_at, start, length))
+            self.write_offset = end
+            return self.seq, self.view[start:end]
+
+    @staticmethod
+    def _overlaps(chunk, start, end):
+        return chunk[2] < end and start < chunk[2] + chunk[3]
+
+    def get(self, seq):
+        """(وقت الالتقاط، شريحة) للكتلة المطلوبة أو None إذا خرجت من الحلقة"""
+        with self.lock:
+            if not self.chunks:
+                return None
+            index = seq - self.chunks[0][0]
+            if index < 0 or index >= len(self.chunks):
+                return None
+            _, captured_at, start, length = self.chunks[index]
+            return captured_at, self.view[start:start + length]
+
+    def recent(self, seconds, rate=None, sample_width=2):
+        """آخر الكتل التي تغطي المدة المطلوبة: قائمة (seq، وقت الالتقاط، شريحة)"""
+        wanted = int(seconds * (rate or RATE)) * sample_width
+        result = []
+        with self.lock:
+            for seq, captured_at, start, length in reversed(self.chunks):
+                if wanted <= 0:
+                    break
+                result.append((seq, captured_at, self.view[start:start + length]))
+                wanted -= length
+        result.reverse()
+        return result
+
+    def chunks_after(self, after_seq):
+        """الكتل الأحدث من after_seq دون انتظار؛ القارئ المتأخر يقفز إلى أقدم المتاح"""
+        with self.lock:
+            if not self.chunks or self.seq <= after_seq:
+                return []
+            first = max(after_seq + 1 - self.chunks[0][0], 0)
+            return [(seq, captured_at, self.view[start:start + length])
+                    for seq, captured_at, start, length in list(self.chunks)[first:]]
+
+    def clear(self):
+        # رقم التسلسل يستمر بالتزايد حتى يبقى ترتيب الإطارات صحيحاً
+        with self.lock:
+            self.chunks.clear()
+            self.write_offset = 0
+
+    def resize(self, seconds, rate, sample_width=2):
+        """مخزن جديد لمعدل عينة مختلف؛ الشرائح القديمة تبقى صالحة لمن يحملها"""
+        with self.lock:
+            self.capacity = int(seconds * rate) * sample_width
+            self.buffer = bytearray(self.capacity)
+            self.view = memoryview(self.buffer)
+            self.chunks.clear()
+            self.write_offset = 0
+
+class SharedAudioRing:
+    """حلقة صوت في ذاكرة مشتركة تنشر فيها عملية الالتقاط وتقرأ منها عمليات النقل
+
+    الرأس: [عدد الخانات، سعة الخانة، آخر رقم تسلسلي منشور، البث فعال].
+    الكاتب يبطل رقم الخانة قبل الكتابة ثم يثبته بعدها، والقارئ يتحقق
+    من الرقم قبل النسخ وبعده فيتجاهل الخانات التي دارت عليها الحلقة.
+    """
+    HEADER_BYTES = 64
+
+    def __init__(self, name=None, slots=64, slot_bytes=65536, create=False):
+        if create:
+            size = self.HEADER_BYTES + slots * (24 + slot_bytes)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # بايثون < 3.13: منع متتبع الموارد من حذف الذاكرة عند خروج القارئ
+                from multiprocessing import resource_tracker
+                self.shm = shared_memory.SharedMemory(name=name)
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.owner = create
+        self.header = np.ndarray(4, dtype=np.int64, buffer=self.shm.buf)
+        if create:
+            self.header[:] = (slots, slot_bytes, 0, 0)
+        self.slots, self.slot_bytes = int(self.header[0]), int(self.header[1])
+        offset = self.HEADER_BYTES
+        self.slot_seq = np.ndarray(self.slots, dtype=np.int64, buffer=self.shm.buf, offset=offset)
+        offset += 8 * self.slots
+        self.slot_ts = np.ndarray(self.slots, dtype=np.float64, buffer=self.shm.buf, offset=offset)
+        offset += 8 * self.slots
+        self.slot_len = np.ndarray(self.slots, dtype=np.int64, buffer=self.shm.buf, offset=offset)
+        offset += 8 * self.slots
+        self.data = np.ndarray((self.slots, self.slot_bytes), dtype=np.uint8,
+                               buffer=self.shm.buf, offset=offset)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def seq(self):
+        return int(self.header[2])
+
+    @property
+    def active(self):
+        return bool(self.header[3])
+
+    def set_active(self, active):
+        self.header[3] = 1 if active else 0
+
+    def write(self, data, captured_at):
+        payload = np.frombuffer(data, dtype=np.uint8)[:self.slot_bytes]
+        seq = self.seq + 1
+        slot = seq % self.slots
+        self.slot_seq[slot] = -1
+        self.data[slot, :len(payload)] = payload
+        self.slot_ts[slot] = captured_at
+        self.slot_len[slot] = len(payload)
+        self.slot_seq[slot] = seq
+        self.header[2] = seq
+        return seq
+
+    def read(self, seq):
+        """(وقت الالتقاط، البايتات) أو None إذا كُتب فوق الخانة"""
+        slot = seq % self.slots
+        if self.slot_seq[slot] != seq:
+            return None
+        captured_at = float(self.slot_ts[slot])
+        payload = self.data[slot, :int(self.slot_len[slot])].tobytes()
+        if self.slot_seq[slot] != seq:
+            return None
+        return captured_at, payload
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class ArchiveWriter:
+    """أرشفة كل ما يُبث في ملفات WAV مقسمة زمنياً، بخيط كتابة مستقل
+
+    الاستدعاء من callback لا يكتب على القرص أبداً: ينسخ الكتلة إلى طابور محدود
+    ويُسقطها (مع العد) إن كان ممتلئاً. خيط الكتابة يجمع الكتل المتراكمة في
+    كتابة واحدة كبيرة عبر ملف بمخزن مؤقت كبير.
+    """
+    def __init__(self, directory, segment_seconds=3600, max_bytes=None, max_age_seconds=None,
+                 rate=RATE, queue_seconds=30, batch_bytes=1 << 20, prefix='radio'):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.rate = rate
+        self.batch_bytes = batch_bytes
+        self.prefix = prefix
+        self.queue = native_queue.Queue(maxsize=max(1, int(queue_seconds * rate / CHUNK)))
+        self.thread = None
+        self.file = None
+        self.wav = None
+        self.path = None
+        self.segment_key = None
+        self.last_end = None  # وقت نهاية آخر كتلة مكتوبة لاكتشاف الانقطاع
+        self.dropped = 0
+        self.bytes_written = 0
+        self.segments = 0
+        self.deleted = 0
+        self.errors = 0
+
+    def __call__(self, chunk, captured_at):
+        # نسخ الكتلة ضروري: شريحة الحلقة تُستبدل بعد RING_SECONDS
+        try:
+            self.queue.put_nowait((captured_at, bytes(chunk), self.rate))
+        except native_queue.Full:
+            self.dropped += 1
+            archive_chunks_dropped.inc()
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.thread = native_threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.queue.put(None)
+        if self.thread:
+            self.thread.join(timeout=5.0)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            # جمع ما تراكم في الطابور في دفعة واحدة ضمن المقطع نفسه
+            batch, size = [item], len(item[1])
+            while size < self.batch_bytes:
+                try:
+                    item = self.queue.get_nowait()
+                except native_queue.Empty:
+                    break
+                if item is None:
+                    self._write(batch)
+                    self._close_segment()
+                    return
+                batch.append(item)
+                size += len(item[1])
+            self._write(batch)
+        self._close_segment()
+
+    def _write(self, batch):
+        start = 0
+        for i, (captured_at, data, rate) in enumerate(batch):
+            if self._needs_rollover(captured_at, rate):
+                self._flush(batch[start:i])
+                self._open_segment(captured_at, rate)
+                start = i
+            self.last_end = captured_at + len(data) / (SAMPLE_WIDTH * rate)
+        self._flush(batch[start:])
+
+    def _needs_rollover(self, captured_at, rate):
+        if self.wav is None or self.wav.getframerate() != rate:
+            return True
+        if int(captured_at // self.segment_seconds) != self.segment_key:
+            return True
+        # انقطاع البث (إيقاف ثم تشغيل): ملف جديد بدل وصل صوتين متباعدين
+        return captured_at - self.last_end > 2.0
+
+    def _flush(self, items):
+        if not items or self.wav is None:
+            return
+        data = b''.join(data for _, data, _ in items)
+        try:
+            # writeframes يحدّث ترويسة الملف بعد كل دفعة فيبقى صالحاً عند الانقطاع
+            self.wav.writeframes(data)
+            self.bytes_written += len(data)
+        except OSError as e:
+            self.errors += 1
+            print(f"خطأ في كتابة الأرشيف: {e}")
+
+    def _open_segment(self, captured_at, rate):
+        self._close_segment()
+        self.segment_key = int(captured_at // self.segment_seconds)
+        name = datetime.fromtimestamp(captured_at).strftime(f'{self.prefix}-%Y%m%d-%H%M%S.wav')
+        self.path = os.path.join(self.directory, name)
+        try:
+            self.file = open(self.path, 'wb', buffering=self.batch_bytes)
+            self.wav = wave.open(self.file, 'wb')
+            self.wav.setnchannels(CHANNELS)
+            self.wav.setsampwidth(SAMPLE_WIDTH)
+            self.wav.setframerate(rate)
+            self.segments += 1
+        except OSError as e:
+            self.errors += 1
+            self.wav = None
+            print(f"خطأ في إنشاء ملف الأرشيف: {e}")
+        self._apply_retention()
+
+    def _close_segment(self):
+        if self.wav is not None:
+            try:
+                self.wav.close()
+                self.file.close()
+            except OSError as e:
+                self.errors += 1
+                print(f"خطأ في إغلاق ملف الأرشيف: {e}")
+        self.wav = None
+        self.file = None
+
+    def _apply_retention(self):
+        """حذف أقدم المقاطع عند تجاوز الحجم الكلي أو العمر (المقطع الحالي لا يُحذف)"""
+        if not self.max_bytes and not self.max_age_seconds:
+            return
+        files = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name.startswith(self.prefix + '-') and name.endswith('.wav') and path != self.path:
+                stat = os.stat(path)
+                files.append((path, stat.st_size, stat.st_mtime))
+        total = sum(size for _, size, _ in files)
+        now = time.time()
+        for path, size, mtime in files:  # الأسماء مرتبة زمنياً: الأقدم أولاً
+            too_big = self.max_bytes and total > self.max_bytes
+            too_old = self.max_age_seconds and now - mtime > self.max_age_seconds
+            if not (too_big or too_old):
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.deleted += 1
+            except OSError as e:
+                print(f"خطأ في حذف ملف أرشيف قديم: {e}")
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'current_file': self.path,
+            'segments': self.segments,
+            'deleted': self.deleted,
+            'bytes_written': self.bytes_written,
+            'queued': self.queue.qsize(),
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
+
+HlsSegment = namedtuple('HlsSegment', 'seq data etag duration discontinuity')
+
+class SegmentCache:
+    """تقطيع البث إلى مقاطع WAV ثابتة المدة لتوصيل HLS عبر HTTP قابل للتخزين المؤقت
+
+    رقم المقطع = floor(وقت الالتقاط / مدة المقطع)، فتنتج كل العمليات وخوادم
+    الترحيل (التي تحمل وقت التقاط الأصل) المقاطع نفسها بالأرقام والـ ETag نفسها.
+    المقطع الأول بعد البدء أو الانقطاع ناقص فلا يُنشر.
+    """
+    def __init__(self, segment_seconds=HLS_SEGMENT_SECONDS, cached=HLS_CACHED_SEGMENTS,
+                 listed=HLS_PLAYLIST_SEGMENTS, rate=RATE):
+        self.segment_seconds = segment_seconds
+        self.cached = cached
+        self.listed = listed
+        self.rate = rate
+        self.segments = OrderedDict()  # seq -> HlsSegment، الأقدم أولاً
+        self.lock = native_threading.Lock()
+        self.current_seq = None
+        self.current = []
+        self.complete = False  # هل بدأ المقطع الحالي من حدّه الزمني
+        self.last_published = None
+
+    def __call__(self, chunk, captured_at):
+        seq = int(captured_at // self.segment_seconds)
+        if seq != self.current_seq:
+            if self.complete and self.current:
+                self._publish(self.current_seq, b''.join(self.current))
+            # مقطع متصل بسابقه يبدأ من حدّه؛ غير ذلك (بدء أو انقطاع) يبدأ من منتصفه
+            self.complete = self.current_seq is not None and seq == self.current_seq + 1
+            self.current_seq = seq
+            self.current = []
+        self.current.append(bytes(chunk))
+
+    def _publish(self, seq, pcm):
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(CHANNELS)
+            wav.setsampwidth(SAMPLE_WIDTH)
+            wav.setframerate(self.rate)
+            wav.writeframes(pcm)
+        data = buffer.getvalue()
+        segment = HlsSegment(seq, data, hashlib.sha1(data).hexdigest()[:20],
+                             len(pcm) / (SAMPLE_WIDTH * self.rate),
+                             self.last_published is not None and seq != self.last_published + 1)
+        with self.lock:
+            self.segments[seq] = segment
+            while len(self.segments) > self.cached:
+                self.segments.popitem(last=False)
+        self.last_published = seq
+
+    def configure(self, rate):
+        # المقطع الجاري بمعدل قديم يُهمل؛ التالي يبدأ كاملاً من حدّه
+        self.rate = rate
+        self.current = []
+        self.complete = False
+
+    def get(self, seq):
+        with self.lock:
+            return self.segments.get(seq)
+
+    def playlist(self):
+        """قائمة تشغيل HLS حية بآخر المقاطع، ويُعاد معها ETag خاص بها"""
+        with self.lock:
+            segments = list(self.segments.values())[-self.listed:]
+        target = math.ceil(max([s.duration for s in segments], default=self.segment_seconds))
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{target}',
+                 f'#EXT-X-MEDIA-SEQUENCE:{segments[0].seq if segments else 0}']
+        for segment in segments:
+            if segment.discontinuity and segment is not segments[0]:
+                lines.append('#EXT-X-DISCONTINUITY')
+            lines.append(f'#EXTINF:{segment.duration:.3f},')
+            lines.append(f'{segment.seq}.wav')
+        etag = f'p{segments[-1].seq}' if segments else 'p-empty'
+        return '\n'.join(lines) + '\n', etag
+
+    def stats(self):
+        with self.lock:
+            seqs = list(self.segments)
+        return {'segments': len(seqs), 'first_seq': seqs[0] if seqs else None,
+                'last_seq': seqs[-1] if seqs else None,
+                'segment_seconds': self.segment_seconds}
+
+class AudioSource:
+    """مصدر صوت يستدعي callback بتوقيع PyAudio: (in_data, frame_count, time_info, status)"""
+    name = 'source'
+
+    def configure(self, rate, frames):
+        """تطبيق معدل العينة وحجم الكتلة (قبل start)"""
+        self.rate = rate
+        self.frames = frames
+
+    def start(self, callback):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+class PyAudioSource(AudioSource):
+    """الميكروفون عبر PyAudio؛ يُنشأ PortAudio عند أول تشغيل فقط"""
+    name = 'mic'
+
+    def __init__(self, rate=RATE, frames=CHUNK):
+        self.rate = rate
+        self.frames = frames
+        self.audio = None
         self.stream = None
+
+    def start(self, callback):
+        if pyaudio is None:
+            raise RuntimeError("مكتبة pyaudio غير مثبتة")
+        if self.audio is None:
+            self.audio = pyaudio.PyAudio()
+
+        def pa_callback(in_data, frame_count, time_info, status):
+            if status & pyaudio.paInputOverflow:
+                input_overflows.inc()
+            callback(in_data, frame_count, time_info, status)
+            return (None, pyaudio.paContinue)
+
+        self.stream = self.audio.open(format=pyaudio.paInt16,
+                                      channels=CHANNELS,
+                                      rate=self.rate,
+                                      input=True,
+                                      frames_per_buffer=self.frames,
+                                      stream_callback=pa_callback)
+        self.stream.start_stream()
+
+    def stop(self):
+        if self.stream:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+
+class PacingScheduler:
+    """خيط أصلي واحد يوقّت كل مصادر الزمن الحقيقي (كومة مواعيد بدل خيط لكل محطة)"""
+
+    def __init__(self):
+        self._heap = []
+        self._order = itertools.count()
+        self._condition = native_threading.Condition()
+        self._thread = None
+
+    def add(self, source, callback, token):
+        """جدولة المصدر فوراً؛ يُسقط لاحقاً عندما يتغير رمز تشغيله (token)"""
+        with self._condition:
+            self._push(time.monotonic(), source, callback, token)
+            if self._thread is None:
+                self._thread = native_threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _push(self, deadline, source, callback, token):
+        heapq.heappush(self._heap, (deadline, next(self._order), source, callback, token))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                deadline = self._heap[0][0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                _, _, source, callback, token = heapq.heappop(self._heap)
+            if token != source.token:
+                continue  # المصدر أُوقف أو أُعيد تشغيله
+            try:
+                data = source.read_chunk(source.frames)
+            except Exception as e:
+                print(f"خطأ في مصدر الصوت ({source.name}): {e}")
+                continue
+            if data is None:
+                print(f"انتهى مصدر الصوت ({source.name})")
+                continue
+            callback(data, source.frames, {}, 0)
+            chunk_seconds = source.frames / source.rate
+            deadline += chunk_seconds
+            if deadline < time.monotonic() - chunk_seconds:
+                # تأخر كبير (توقف مؤقت مثلاً): نتابع من الآن بدل إرسال دفعة متلاحقة
+                deadline = time.monotonic()
+            with self._condition:
+                self._push(deadline, source, callback, token)
+
+source_scheduler = PacingScheduler()
+
+class PacedSource(AudioSource):
+    """مصدر يُقرأ على المجدول المشترك بإيقاع الزمن الحقيقي، أو في خيط أصلي خاص بأقصى سرعة"""
+
+    def __init__(self, rate=RATE, frames=CHUNK, realtime=True):
+        self.rate = rate
+        self.frames = frames
+        self.realtime = realtime
+        self.token = 0
+        self._stop = native_threading.Event()
+        self._thread = None
+
+    def read_chunk(self, frames):
+        """إرجاع frames عينة int16 كبايتات، أو None عند انتهاء المصدر"""
+        raise NotImplementedError
+
+    def start(self, callback):
+        self.stop()
+        if self.realtime:
+            source_scheduler.add(self, callback, self.token)
+            return
+        self._stop = native_threading.Event()
+        self._thread = native_threading.Thread(target=self._run, args=(callback, self._stop),
+                                               daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.token += 1
+        self._stop.set()
+        if self._thread and self._thread is not native_threading.current_thread():
+            self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def _run(self, callback, stop):
+        while not stop.is_set():
+            data = self.read_chunk(self.frames)
+            if data is None:
+                print(f"انتهى مصدر الصوت ({self.name})")
+                break
+            callback(data, self.frames, {}, 0)
+
+class WavFileSource(PacedSource):
+    """قراءة ملف WAV (16 بت) بشكل دائري؛ يُحوَّل إلى أحادي وإلى معدل البث عند التحميل"""
+    name = 'wav'
+
+    def __init__(self, path, loop=True, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.loop = loop
+        self.samples = self._load(path)
+        self.position = 0
+
+    def configure(self, rate, frames):
+        if rate != self.rate:
+            self.rate = rate
+            self.samples = self._load(self.path)
+            self.position = 0
+        self.frames = frames
+
+    def _load(self, path):
+        with wave.open(path, 'rb') as wav:
+            if wav.getsampwidth() != SAMPLE_WIDTH:
+                raise ValueError(f"الملف {path} ليس 16 بت")
+            channels = wav.getnchannels()
+            file_rate = wav.getframerate()
+            samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1)
+        if file_rate != self.rate:
+            divisor = math.gcd(file_rate, self.rate)
+            samples = resample_poly(samples, self.rate // divisor, file_rate // divisor)
+        samples = np.clip(samples, -32767, 32767).astype(np.int16)
+        if not len(samples):
+            raise ValueError(f"الملف {path} فارغ")
+        return samples
+
+    def read_chunk(self, frames):
+        end = self.position + frames
+        if end <= len(self.samples):
+            chunk = self.samples[self.position:end]
+            self.position = end
+            return chunk.tobytes()
+        if not self.loop:
+            if self.position >= len(self.samples):
+                return None
+            chunk = np.zeros(frames, dtype=np.int16)
+            tail = self.samples[self.position:]
+            chunk[:len(tail)] = tail
+            self.position = len(self.samples)
+            return chunk.tobytes()
+        # الالتفاف إلى بداية الملف (قد يتكرر إن كان الملف أقصر من كتلة)
+        indices = np.arange(self.position, end) % len(self.samples)
+        self.position = end % len(self.samples)
+        return self.samples[indices].tobytes()
+
+class ToneSource(PacedSource):
+    """مولد نغمة جيبية و/أو ضوضاء بيضاء للاختبار دون ميكروفون"""
+    name = 'tone'
+
+    def __init__(self, frequency=440.0, amplitude=0.3, noise=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.noise = noise
+        self.phase = 0.0
+        self.rng = np.random.default_rng()
+
+    def read_chunk(self, frames):
+        step = 2 * np.pi * self.frequency / self.rate
+        signal = self.amplitude * np.sin(self.phase + step * np.arange(frames))
+        self.phase = (self.phase + step * frames) % (2 * np.pi)
+        if self.noise:
+            signal += self.noise * self.rng.standard_normal(frames)
+        return (np.clip(signal, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+
+class PipeSource(PacedSource):
+    """PCM خام (int16 أحادي بمعدل البث) من stdin أو أنبوب؛ الكاتب يحدد الإيقاع عادةً"""
+    name = 'pipe'
+
+    def __init__(self, stream=None, realtime=False, **kwargs):
+        super().__init__(realtime=realtime, **kwargs)
+        self.stream = stream if stream is not None else sys.stdin.buffer
+
+    def read_chunk(self, frames):
+        size = frames * SAMPLE_WIDTH
+        data = bytearray()
+        while len(data) < size:
+            part = self.stream.read(size - len(data))
+            if not part:
+                break
+            data += part
+        if not data:
+            return None
+        # إكمال الكتلة الأخيرة الناقصة بالصمت
+        return bytes(data.ljust(size, b'\0'))
+
+def create_source(spec, realtime=True):
+    """إنشاء مصدر من وصف نصي: mic | tone[:freq] | noise[:level] | wav:PATH | stdin | pipe:PATH"""
+    kind, _, arg = spec.partition(':')
+    options = {'rate': RATE, 'frames': CHUNK}
+    if kind == 'mic':
+        return PyAudioSource(**options)
+    if kind == 'tone':
+        return ToneSource(frequency=float(arg or 440), realtime=realtime, **options)
+    if kind == 'noise':
+        return ToneSource(amplitude=0.0, noise=float(arg or 0.1), realtime=realtime, **options)
+    if kind == 'wav':
+        return WavFileSource(arg, realtime=realtime, **options)
+    if kind == 'stdin':
+        return PipeSource(**options)
+    if kind == 'pipe':
+        return PipeSource(open(arg, 'rb'), **options)
+    raise ValueError(f"مصدر صوت غير معروف: {spec}")
+
+class AudioProcessor:
+    def __init__(self, source=None):
+        self.source = source or PyAudioSource()
         self.is_recording = False
         self.volume = 1.0
         self.noise_reduction = False
         self.muted = False
         self.low_pass_filter = False
         self.high_pass_filter = False
-        self.audio_queue = queue.Queue(maxsize=20)  # بفر للصوت
+        self.low_pass = StreamingFilter(4, 3000, 'low')
+        self.high_pass = StreamingFilter(4, 300, 'high')
+        self.noise_suppressor = StreamingNoiseSuppressor()
+        # الديناميكية: المحدد يعمل دائماً افتراضياً بدل القص الحاد عند ±32767
+        self.agc_enabled = False
+        self.compressor_enabled = False
+        self.limiter_enabled = True
+        self.agc = AutomaticGainControl()
+        self.compressor = Compressor()
+        self.limiter = LookaheadLimiter()
+        self.stage_timings = {}  # توقيت كل مرحلة بالاسم، يبقى بين إعادات البناء
+        self.pipeline = DspPipeline()
+        self.rebuild_pipeline()
+        self.ring = BroadcastRing()  # نسخة واحدة من كل كتلة يشاركها الجميع
+        self.audio_queue = native_queue.Queue(maxsize=20)  # إشعارات الكتل الجديدة
+        self.sinks = []  # مستهلكون إضافيون لكل كتلة معالجة (مثل الذاكرة المشتركة)
+        self.on_publish = None  # إشعار مجمع التوزيع بوصول كتلة (من خيط الالتقاط)
         self.buffer_thread = None
         
     def start_recording(self):
         try:
-            self.stream = self.audio.open(format=FORMAT,
-                                        channels=CHANNELS,
-                                        rate=RATE,
-                                        input=True,
-                                        frames_per_buffer=CHUNK,
-                                        stream_callback=self._audio_callback)
+            self.source.start(self._audio_callback)
             self.is_recording = True
-            self.stream.start_stream()
             return True
         except Exception as e:
             print(f"خطأ في بدء التسجيل: {e}")
             return False
 
-    def process_audio_fast(self, data):
-        """معالجة سريعة للصوت"""
+    def configure(self, rate, frames, queue_size):
+        """تطبيق ملف زمن الوصول؛ يُستدعى والتسجيل متوقف"""
+        self.source.configure(rate, frames)
+        if rate != self.noise_suppressor.rate:
+            self.ring.resize(RING_SECONDS, rate)
+            # المرشحات وبصمة الضوضاء مصممة لمعدل العينة السابق
+            self.low_pass = StreamingFilter(4, 3000, 'low', rate)
+            self.high_pass = StreamingFilter(4, 300, 'high', rate)
+            self.noise_suppressor = StreamingNoiseSuppressor(rate)
+            if self.noise_reduction:
+                print("⚠️ بصمة الضوضاء أُلغيت مع تغيير معدل العينة: التقط بصمة جديدة أثناء الصمت")
+            self.agc = AutomaticGainControl(rate)
+            self.compressor = Compressor(rate)
+            self.limiter = LookaheadLimiter(rate)
+            self.rebuild_pipeline(rate)
+        # الطابور نفسه يبقى لأن عمال التوزيع يحملون مرجعه
+        self.audio_queue.maxsize = queue_size
+
+    def rebuild_pipeline(self, rate=None):
+        """تجميع السلسلة الفعالة من إعدادات التحكم؛ تُستبدل بإسناد واحد يراه callback كاملاً"""
         if self.muted:
-            return np.zeros_like(data)
-        
-        # تطبيق مستوى الصوت فقط لتجنب التأخير
-        data = data * self.volume
-        
-        # تطبيع الصوت
-        data = np.clip(data, -32767, 32767)
-        return data.astype(np.int16) 
+            stages = [('mute', MuteStage())]
+        else:
+            stages = [('gain', GainStage(self.volume))] + [
+                (name, stage) for name, stage, enabled in (
+                    ('noise', self.noise_suppressor, self.noise_reduction),
+                    ('low_pass', self.low_pass, self.low_pass_filter),
+                    ('high_pass', self.high_pass, self.high_pass_filter),
+                    ('agc', self.agc, self.agc_enabled),
+                    ('compressor', self.compressor, self.compressor_enabled),
+                    ('limiter', self.limiter, self.limiter_enabled),
+                ) if enabled]
+        if self.noise_suppressor.capture_frames_left and (self.muted or not self.noise_reduction):
+            # البوابة خارج السلسلة: نقرة تحليل قبل كل المراحل تكمل الالتقاط
+            stages.insert(0, ('noise_profile', NoiseProfileTap(self.noise_suppressor, self.volume)))
+        # المراحل المضافة للتو تبدأ بحالة نظيفة بدل حالة قديمة منقطعة
+        active = {id(stage) for _, stage, _ in self.pipeline.stages}
+        for _, stage in stages:
+            if id(stage) not in active and hasattr(stage, 'reset'):
+                stage.reset()
+        self.pipeline = DspPipeline(stages, rate or self.pipeline.rate, self.stage_timings)
+
+    def set_noise_reduction(self, enabled):
+        # لا تعلّم تلقائي عند التفعيل: الثانية الأولى غالباً كلام وستُكتم به الأصوات؛
+        # دون بصمة تمر البوابة الصوت كما هو حتى يُطلب الالتقاط
+        self.noise_reduction = enabled
+        self.rebuild_pipeline()
+
+    def capture_noise_profile(self, seconds=1.0):
+        """التقاط بصمة الضوضاء أياً كانت حالة البوابة"""
+        self.noise_suppressor.capture_profile(seconds)
+        self.rebuild_pipeline()
+
+    def dynamics_stats(self):
+        return {'agc': dict(self.agc.stats(), enabled=self.agc_enabled),
+                'compressor': dict(self.compressor.stats(), enabled=self.compressor_enabled),
+                'limiter': dict(self.limiter.stats(), enabled=self.limiter_enabled)}
+
+    def pipeline_stats(self):
+        return {'chain': self.pipeline.names,
+                'stages': {name: timing.stats() for name, timing in list(self.stage_timings.items())}}
+
+    def process_audio(self, data):
+        """تمرير الكتلة في السلسلة المجمّعة ثم تطبيعها إلى int16"""
+        return clip_to_int16(self.pipeline.process(data))
     
     def stop_recording(self):
-        if self.stream:
-            self.stream.stop_stream()
-            self.stream.close()
+        self.source.stop()
         self.is_recording = False
+        self.ring.clear()
         
         # تنظيف الطابور
         while not self.audio_queue.empty():
             try:
                 self.audio_queue.get_nowait()
-            except:
+            except native_queue.Empty:
                 break
     
     def _audio_callback(self, in_data, frame_count, time_info, status):
         """callback للصوت لتجنب التقطيع"""
+        started = time.perf_counter()
         try:
             audio_data = np.frombuffer(in_data, dtype=np.int16)
-            processed_data = self.process_audio_fast(audio_data)
+            processed_data = self.process_audio(audio_data)
             
-            # إضافة البيانات للطابور
-            if not self.audio_queue.full():
-                self.audio_queue.put(processed_data.tobytes())
+            self.publish(processed_data, time.time())
+            callback_seconds.observe(time.perf_counter() - started)
             
         except Exception as e:
             print(f"خطأ في callback: {e}")
-        
-        return (None, pyaudio.paContinue)
 
-    def process_audio(self, data):
-        if self.muted:
-            return np.zeros_like(data)
-        
-        # تطبيق مستوى الصوت
-        data = data * self.volume
-        
-        # تقليل الضوضاء
-        if self.noise_reduction:
-            try:
-                data = nr.reduce_noise(y=data, sr=RATE)
-            except:
-                pass
-        
-        # مرشح تمرير منخفض
-        if self.low_pass_filter:
-            try:
-                b, a = butter(4, 3000, btype='low', fs=RATE)
-                data = filtfilt(b, a, data)
-            except:
-                pass
-        
-        # مرشح تمرير عالي
-        if self.high_pass_filter:
-            try:
-                b, a = butter(4, 300, btype='high', fs=RATE)
-                data = filtfilt(b, a, data)
-            except:
-                pass
-        
-        # تطبيع الصوت
-        data = np.clip(data, -32767, 32767)
-        return data.astype(np.int16)
-    
-    def get_audio_chunk(self):
-        try:
-            # استخراج البيانات من الطابور
-            return self.audio_queue.get(timeout=0.1)
-        except queue.Empty:
-            return None
-        except Exception as e:
-            print(f"خطأ في قراءة الصوت: {e}")
-            return None
+    def publish(self, data, captured_at):
+        """نشر كتلة معالجة لخيط البث وللمستهلكين الإضافيين"""
+        # الكتلة تُكتب مرة واحدة في الحلقة، والطابور يحمل وقت الالتقاط ورقمها وشريحتها
+        seq, chunk = self.ring.write(data, captured_at)
+        if not self.audio_queue.full():
+            self.audio_queue.put((captured_at, seq, chunk))
+        else:
+            chunks_dropped.inc()
+        if self.on_publish:
+            self.on_publish()
+        for sink in self.sinks:
+            sink(chunk, captured_at)
+
+# جداول IMA-ADPCM القياسية
+IMA_STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767], dtype=np.int32)
+IMA_INDEX_TABLE = np.array([-1, -1, -1, -1, 2, 4, 6, 8], dtype=np.int32)
+
+def build_ima_state_tables():
+    """جداول الحالة (مؤشر الخطوة << 4 | الرمز بإشارته) -> الفرق بإشارته والحالة التالية
+
+    كل خطوة في حلقة الترميز وفك الترميز تصبح بحثين في جدول بدل حساب الفرق
+    من بتات الرمز وقص المؤشر، فتقل عمليات NumPy على المصفوفات الصغيرة.
+    """
+    codes = np.arange(16)
+    step = IMA_STEP_TABLE[:, None]
+    magnitude = ((step >> 3) + ((codes >> 2) & 1) * step
+                 + ((codes >> 1) & 1) * (step >> 1) + (codes & 1) * (step >> 2))
+    delta = np.where(codes & 8, -magnitude, magnitude).astype(np.int32).ravel()
+    next_index = np.clip(np.arange(89)[:, None] + IMA_INDEX_TABLE[codes & 7], 0, 88)
+    return delta, (next_index << 4).astype(np.int32).ravel()
+
+IMA_DELTA_TABLE, IMA_NEXT_STATE = build_ima_state_tables()
+
+class Pcm16Codec:
+    """PCM خام 16 بت بدون ضغط"""
+    name = 'pcm16'
+
+    def encode(self, pcm):
+        return bytes(pcm)
+
+    def decode(self, payload):
+        return np.frombuffer(payload, dtype=np.int16)
+
+class MuLawCodec:
+    """ترميز G.711 μ-law متجه بالكامل عبر NumPy (ضغط 2:1)"""
+    name = 'mulaw'
+    BIAS = 0x84
+    CLIP = 32635
+
+    def __init__(self):
+        # جدول فك الترميز لكل البايتات الممكنة
+        codes = ~np.arange(256, dtype=np.int32) & 0xFF
+        exponent = (codes >> 4) & 0x07
+        mantissa = codes & 0x0F
+        magnitude = (((mantissa << 3) + self.BIAS) << exponent) - self.BIAS
+        self.decode_table = np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+    def encode(self, pcm):
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.int32)
+        sign = (samples < 0).astype(np.int32) << 7
+        magnitude = np.minimum(np.abs(samples), self.CLIP) + self.BIAS
+        # الأس = عدد بتات المقدار - 8 (المقدار بين 132 و 32767)
+        exponent = np.frexp(magnitude)[1] - 8
+        mantissa = (magnitude >> (exponent + 3)) & 0x0F
+        return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
+
+    def decode(self, payload):
+        return self.decode_table[np.frombuffer(payload, dtype=np.uint8)]
+
+class ImaAdpcmCodec:
+    """ترميز IMA-ADPCM بكتل مستقلة (ضغط ~4:1)
+
+    كل كتلة من 128 عينة تبدأ برأس (العينة الأولى، مؤشر الخطوة) فتُفك
+    مستقلة عن غيرها، وهذا يسمح بترميز كل الكتل معاً بشكل متجه: الحلقة
+    تمر على مواقع العينات داخل الكتلة لا على كل عينة في الكتلة الصوتية.
+    الإطار: uint32 عدد العينات ثم الكتل (4 بايت رأس + 64 بايت رموز).
+    """
+    name = 'adpcm'
+    BLOCK = 128
+
+    def encode(self, pcm):
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        count = len(samples)
+        n_blocks = -(-count // self.BLOCK)
+        blocks = np.empty(n_blocks * self.BLOCK, dtype=np.int32)
+        blocks[:count] = samples
+        blocks[count:] = samples[-1] if count else 0
+        blocks = blocks.reshape(n_blocks, self.BLOCK)
+
+        # مؤشر البداية يُقدَّر من متوسط الفروق الأولى في كل كتلة
+        first_diffs = np.abs(np.diff(blocks[:, :9], axis=1)).mean(axis=1)
+        index = np.clip(np.searchsorted(IMA_STEP_TABLE, first_diffs), 0, 88)
+        predictor = blocks[:, 0].copy()
+        state = index << 4
+
+        # أعمدة متصلة: موقع العينة نفسه في كل الكتل صف واحد في الذاكرة
+        columns = np.ascontiguousarray(blocks.T)
+        codes = np.zeros((self.BLOCK, n_blocks), dtype=np.int32)
+        for i in range(1, self.BLOCK):
+            diff = columns[i] - predictor
+            code = np.minimum((np.abs(diff) << 2) // IMA_STEP_TABLE.take(state >> 4), 7)
+            code |= (diff < 0) << 3
+            state |= code
+            predictor += IMA_DELTA_TABLE.take(state)
+            np.clip(predictor, -32768, 32767, out=predictor)
+            state = IMA_NEXT_STATE.take(state)
+            codes[i - 1] = code
+
+        codes = codes.T.astype(np.uint8)
+        packed = codes[:, 0::2] | (codes[:, 1::2] << 4)
+        header = np.zeros((n_blocks, 4), dtype=np.uint8)
+        header[:, :2] = blocks[:, 0].astype('<i2').view(np.uint8).reshape(n_blocks, 2)
+        header[:, 2] = index
+        return struct.pack('<I', count) + np.hstack((header, packed)).tobytes()
+
+    def decode(self, payload):
+        count = struct.unpack_from('<I', payload)[0]
+        frames = np.frombuffer(payload, dtype=np.uint8, offset=4).reshape(-1, 4 + self.BLOCK // 2)
+        predictor = frames[:, :2].copy().view('<i2')[:, 0].astype(np.int32)
+        state = frames[:, 2].astype(np.int32) << 4
+        codes = np.empty((self.BLOCK, len(frames)), dtype=np.int32)
+        codes[0::2] = (frames[:, 4:] & 0x0F).T
+        codes[1::2] = (frames[:, 4:] >> 4).T
+        out = np.empty((self.BLOCK, len(frames)), dtype=np.int16)
+        out[0] = predictor
+        for i in range(1, self.BLOCK):
+            state |= codes[i - 1]
+            predictor += IMA_DELTA_TABLE.take(state)
+            np.clip(predictor, -32768, 32767, out=predictor)
+            state = IMA_NEXT_STATE.take(state)
+            out[i] = predictor
+        return out.T.ravel()[:count]
+
+# الترميزات المتاحة للمستمعين، كل كتلة تُرمَّز مرة واحدة لكل ترميز مستخدم
+CODECS = {codec.name: codec for codec in (Pcm16Codec(), MuLawCodec(), ImaAdpcmCodec())}
+DEFAULT_CODEC = 'pcm16'
+
+# إعدادات طوابير الإرسال لكل مستمع
+LISTENER_QUEUE_SIZE = 10        # أقصى عدد إطارات تنتظر الإرسال
+LISTENER_SEND_WINDOW = 4        # أقصى عدد إطارات مرسلة دون إقرار من العميل
+LISTENER_QUEUE_POLICY = 'drop_oldest'  # drop_oldest | skip_to_live | disconnect
+LISTENER_MAX_LAG_SECONDS = 10   # حد التأخر لسياسة disconnect
+LISTENER_ACK_TIMEOUT_SECONDS = 2  # إطار بلا إقرار بعد هذه المدة يُعدّ مفقوداً ويحرر النافذة
+QUEUE_POLICIES = ('drop_oldest', 'skip_to_live', 'disconnect')
+
+class ListenerSession:
+    """جلسة مستمع: طابور إرسال محدود بأرقام تسلسلية وتحكم بالتدفق عبر إقرارات العميل
+
+    العميل البطيء يملأ طابوره الخاص فقط؛ عند الامتلاء تُطبَّق السياسة
+    (إسقاط الأقدم أو القفز إلى البث الحي) دون أن يتأثر باقي المستمعين.
+    """
+    def __init__(self, sid, codec, send, policy=None, tier=None, requested_tier=None):
+        self.sid = sid
+        self.codec = codec
+        self.tier = tier or RATE  # معدل العينة الذي يستلمه المستمع
+        self.requested_tier = requested_tier
+        self.send = send  # send(sid, frame, callback)
+        self.policy = policy or LISTENER_QUEUE_POLICY
+        if self.policy not in QUEUE_POLICIES:
+            raise ValueError(f"سياسة طابور غير معروفة: {self.policy}")
+        self.joined_at = time.time()
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.in_flight = deque()  # (seq, وقت الالتقاط, وقت الإرسال) للإطارات غير المُقرّة
+        self.sent = 0
+        self.dropped = 0
+        self.underruns = 0
+        self.ack_timeouts = 0
+        self.acked_seq = -1
+        self.pushed_seq = -1
+
+    def push(self, frame):
+        with self.lock:
+            # تجاهل ما غطّته الدفعة الأولية مسبقاً حتى يبقى الترتيب تصاعدياً
+            if frame['seq'] <= self.pushed_seq:
+                return
+            self.pushed_seq = frame['seq']
+            self.pending.append(frame)
+            overflow = len(self.pending) - LISTENER_QUEUE_SIZE
+            if overflow > 0:
+                if self.policy == 'skip_to_live':
+                    # التخلي عن كل ما تأخر والاحتفاظ بآخر إطار فقط
+                    overflow = len(self.pending) - 1
+                for _ in range(overflow):
+                    self.pending.popleft()
+                self.dropped += overflow
+                listener_frames_dropped.inc(self.policy, overflow)
+            if self.policy != 'disconnect':
+                self._expire_in_flight()
+            frames = self._take_sendable()
+        self._send(frames)
+
+    def ack(self, seq=None, *_):
+        """callback الإقرار من العميل: يحرر نافذة الإرسال ويدفع الإطارات التالية
+
+        أي قيمة ليست رقماً تسلسلياً صحيحاً (مثل True من عميل قديم) تُعامل كإقرار
+        بأقدم إطار مرسل.
+        """
+        if not isinstance(seq, int) or isinstance(seq, bool):
+            seq = None
+        with self.lock:
+            if seq is None:
+                if self.in_flight:
+                    self.acked_seq = self.in_flight.popleft()[0]
+            else:
+                while self.in_flight and self.in_flight[0][0] <= seq:
+                    self.in_flight.popleft()
+                self.acked_seq = max(self.acked_seq, seq)
+            frames = self._take_sendable()
+        self._send(frames)
+
+    def _take_sendable(self):
+        frames = []
+        while self.pending and len(self.in_flight) < LISTENER_SEND_WINDOW:
+            frame = self.pending.popleft()
+            self.in_flight.append((frame['seq'], frame['ts'], time.monotonic()))
+            frames.append(frame)
+        self.sent += len(frames)
+        return frames
+
+    def _expire_in_flight(self):
+        """إسقاط الإطارات التي لم يُقرّ بها العميل خلال المهلة
+
+        عميل توقف عن الإقرار (أو لا يُقرّ أصلاً) لا يبقى عالقاً بنافذة ممتلئة؛
+        سياسة disconnect تستثنى لأنها تفصل العميل المتأخر بدلاً من ذلك.
+        """
+        deadline = time.monotonic() - LISTENER_ACK_TIMEOUT_SECONDS
+        expired = 0
+        while self.in_flight and self.in_flight[0][2] < deadline:
+            self.in_flight.popleft()
+            expired += 1
+        self.ack_timeouts += expired
+
+    def _send(self, frames):
+        for frame in frames:
+            self.send(self.sid, frame, self.ack)
+
+    def lag_seconds(self, now=None):
+        """عمر أقدم إطار لم يُقرّ به العميل بعد"""
+        with self.lock:
+            if self.in_flight:
+                oldest = self.in_flight[0][1]
+            elif self.pending:
+                oldest = self.pending[0]['ts']
+            else:
+                return 0.0
+        return max(0.0, (now or time.time()) - oldest)
+
+    def is_too_far_behind(self, now=None):
+        return self.policy == 'disconnect' and self.lag_seconds(now) > LISTENER_MAX_LAG_SECONDS
+
+    def stats(self):
+        return {
+            'codec': self.codec,
+            'tier': self.tier,
+            'policy': self.policy,
+            'queued': len(self.pending),
+            'in_flight': len(self.in_flight),
+            'acked_seq': self.acked_seq,
+            'lag_seconds': round(self.lag_seconds(), 3),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'underruns': self.underruns,
+            'ack_timeouts': self.ack_timeouts,
+        }
+
+def resolve_public_ip():
+    response = requests.get('https://api.ipify.org', timeout=5)
+    response.raise_for_status()
+    return response.text.strip()
+
+def resolve_local_ip():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(("8.8.8.8", 80))
+        return s.getsockname()[0]
+    finally:
+        s.close()
 
 class NetworkManager:
-    @staticmethod
-    def get_public_ip():
+    """معلومات الشبكة: تُحل في الخلفية وتُخزن مؤقتاً، وتُعاد آخر قيمة معروفة فوراً
+
+    المحللات قابلة للحقن (مثلاً لاختبارات بلا شبكة)، والمحلل الذي يفشل
+    يُبقي القيمة السابقة دون تغيير ويُعاد تشغيله بعد retry_interval بدل ttl.
+    """
+    def __init__(self, public_ip_resolver=resolve_public_ip,
+                 local_ip_resolver=resolve_local_ip, ttl=600, retry_interval=30,
+                 on_update=None):
+        self.resolvers = {'public_ip': public_ip_resolver, 'local_ip': local_ip_resolver}
+        self.values = {'public_ip': "غير متاح", 'local_ip': "127.0.0.1"}
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.on_update = on_update
+        self.expires_at = 0.0
+        self.failed = set()  # المحللات التي فشلت في آخر تحديث
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get_public_ip(self):
+        self.refresh_in_background()
+        return self.values['public_ip']
+
+    def get_local_ip(self):
+        self.refresh_in_background()
+        return self.values['local_ip']
+
+    def refresh_in_background(self):
+        """بدء تحديث في الخلفية إذا انتهت صلاحية القيم (دون انتظار)"""
+        if time.time() < self.expires_at:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def resolve(self, key):
+        """تشغيل محلل واحد فوراً؛ يعيد True إذا تغيرت القيمة"""
         try:
-            response = requests.get('https://api.ipify.org', timeout=5)
-            return response.text.strip()
-        except:
-            return "غير متاح"
-    
-    @staticmethod
-    def get_local_ip():
+            value = self.resolvers[key]()
+        except Exception:
+            value = None
+        if not value:
+            self.failed.add(key)
+            return False
+        self.failed.discard(key)
+        if value != self.values[key]:
+            self.values[key] = value
+            return True
+        return False
+
+    def refresh(self):
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip = s.getsockname()[0]
-            s.close()
-            return ip
-        except:
-            return "127.0.0.1"
+            changed = False
+            for key in self.resolvers:
+                changed = self.resolve(key) or changed
+            # إقلاع بلا شبكة لا يُثبّت "غير متاح" طوال مدة ttl
+            self.expires_at = time.time() + (self.retry_interval if self.failed else self.ttl)
+            if changed and self.on_update:
+                self.on_update(dict(self.values))
+        finally:
+            self._refreshing = False
 
 # تطبيق Flask
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'radio_streaming_secret_key'
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE)
+
+class FanoutPool:
+    """طابور جاهزية واحد وعدد ثابت من العمال يوزعون كتل كل المحطات"""
+
+    def __init__(self, workers=FANOUT_WORKERS):
+        self.workers = workers
+        self.ready = native_queue.Queue()  # محطات وصلتها كتل جديدة (يُملأ من خيوط الالتقاط)
+        self.started = False
+
+    def notify(self, station):
+        """يُستدعى من خيط الالتقاط؛ المحطة تدخل الطابور مرة واحدة حتى يبدأ توزيعها"""
+        if not station.pending:
+            station.pending = True
+            self.ready.put(station)
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        for _ in range(self.workers):
+            socketio.start_background_task(self._worker)
+
+    def _worker(self):
+        while True:
+            # انتظار مباشر على الطابور: لا تأخير إضافي بعد وصول الكتلة
+            station = run_blocking(self.ready.get)
+            station.pump()
+
+class Station:
+    """محطة: مصدر وسلسلة معالجة وغرفة مستمعين وإحصائيات خاصة بها
+
+    المصادر تُوقَّت على المجدول المشترك والتوزيع يتم في مجمع العمال المشترك،
+    فالمحطة الإضافية تكلف معالجة كتلها فقط وليس خيوطاً أو عملية جديدة.
+    """
+
+    def __init__(self, name, processor, listeners=None, stats=None):
+        self.name = name
+        self.processor = processor
+        self.listeners = {} if listeners is None else listeners
+        self.stats = stats if stats is not None else {
+            "listeners": 0, "start_time": None, "data_sent": 0,
+            "latency_ms": {"last": 0.0, "avg": 0.0, "max": 0.0}}
+        self.active = False
+        self.pending = False
+        self.lock = threading.Lock()  # عامل واحد يوزع المحطة في كل لحظة (يحفظ ترتيب الكتل ويحمي انضمام المستمعين)
+        self.resamplers = {}  # (معدل الالتقاط، الطبقة) -> [StreamingResampler، آخر seq]
+        self.last_stats_update = 0
+        # المحطة الرئيسية تحتفظ بأسماء الغرف القديمة
+        self.room = LISTENERS_ROOM if name == MAIN_STATION else f"{LISTENERS_ROOM}@{name}"
+        self.admin_room = f"admin:{name}"  # لوحات التحكم فقط (إطارات الطيف)
+        self.admins = set()
+        self.spectrum = SpectrumAnalyzer()
+        processor.on_publish = lambda: fanout_pool.notify(self)
+
+    def start(self):
+        if not self.processor.start_recording():
+            return False
+        self.active = True
+        self.stats['start_time'] = time.time()
+        return True
+
+    def stop(self):
+        self.active = False
+        self.processor.stop_recording()
+
+    def stream_room(self, codec, tier=None):
+        return f"{self.room}:{tier or RATE}:{codec}"
+
+    def assign_stream(self, session, codec, tier):
+        """نقل المستمع إلى غرفة (الطبقة، الترميز) الجديدة؛ يعمل خارج سياق الطلب أيضاً"""
+        old_room = self.stream_room(session.codec, session.tier)
+        session.codec, session.tier = codec, tier
+        new_room = self.stream_room(codec, tier)
+        if old_room != new_room:
+            socketio.server.leave_room(session.sid, old_room, namespace='/')
+        socketio.server.enter_room(session.sid, new_room, namespace='/')
+
+    def room_counts(self):
+        """عدد الأعضاء في غرفة المستمعين وفي غرفة كل طبقة وترميز"""
+        manager = socketio.server.manager
+        rooms = [self.room] + [self.stream_room(codec, tier) for tier in available_tiers()
+                               for codec in CODECS]
+        return {room: sum(1 for _ in manager.get_participants('/', room)) for room in rooms}
+
+    def resample_for_tier(self, tier, seq, pcm):
+        """كتلة الطبقة المطلوبة؛ تُحسب مرة لكل طبقة مهما كان عدد مستمعيها"""
+        if tier == RATE:
+            return pcm
+        entry = self.resamplers.get((RATE, tier))
+        if entry is None:
+            entry = self.resamplers[(RATE, tier)] = [StreamingResampler(RATE, tier), seq - 1]
+        if seq != entry[1] + 1:
+            entry[0].reset()  # فجوة في الكتل: الحالة المحمولة لم تعد متصلة
+        entry[1] = seq
+        return clip_to_int16(entry[0].process(np.frombuffer(pcm, dtype=np.int16)))
+
+    def send_frame(self, sid, frame, callback):
+        """إرسال إطار لمستمع واحد مع طلب إقرار بالاستلام"""
+        socketio.emit('audio_data', frame, to=sid, callback=callback)
+        socket_emits.inc('audio_data')
+        self.stats['data_sent'] += len(frame['data'])
+
+    def record_latency(self, captured_at):
+        """تسجيل التأخير من التقاط الكتلة حتى إرسالها"""
+        latency = self.stats['latency_ms']
+        delay_ms = (time.time() - captured_at) * 1000
+        latency['last'] = round(delay_ms, 2)
+        latency['avg'] = round(latency['avg'] * 0.95 + delay_ms * 0.05, 2)
+        latency['max'] = round(max(latency['max'], delay_ms), 2)
+
+    def pump(self):
+        """توزيع كل الكتل المنتظرة بالترتيب ثم إرسال الإحصائيات عند حلول موعدها"""
+        with self.lock:
+            self.pending = False
+            while True:
+                try:
+                    item = self.processor.audio_queue.get_nowait()
+                except native_queue.Empty:
+                    break
+                try:
+                    self.fan_out(*item)
+                except Exception as e:
+                    print(f"خطأ في خيط البث ({self.name}): {e}")
+            self.emit_stats()
+
+    def fan_out(self, captured_at, chunk_seq, data_to_send):
+        queue_wait_seconds.observe(max(0.0, time.time() - captured_at))
+        if self.admins and self.spectrum.due(time.time()):
+            self.emit_spectrum(data_to_send)
+        if self.name == MAIN_STATION:
+            # بث HTTP يخدم المحطة الرئيسية
+            with fanout_condition:
+                fanout_condition.notify_all()
+
+        # إرسال البيانات إذا كان هناك مستمعين
+        if self.listeners:
+            sessions = list(self.listeners.values())
+            # تحويل واحد لكل طبقة وترميز واحد لكل (طبقة، ترميز) مهما كان عدد المستمعين
+            variants = {(session.tier, session.codec) for session in sessions}
+            pcm_by_tier = {tier: self.resample_for_tier(tier, chunk_seq, data_to_send)
+                           for tier in {tier for tier, _ in variants}}
+            frames = {}
+            for tier, codec_name in variants:
+                started = time.perf_counter()
+                frames[(tier, codec_name)] = {'seq': chunk_seq, 'ts': captured_at,
+                                              'data': CODECS[codec_name].encode(pcm_by_tier[tier])}
+                encode_seconds.observe(time.perf_counter() - started, codec_name)
+
+            started = time.perf_counter()
+            now = time.time()
+            for session in sessions:
+                # البايتات تُرسل كمرفق ثنائي إلى طابور المستمع الخاص
+                session.push(frames[(session.tier, session.codec)])
+                if session.is_too_far_behind(now):
+                    print(f"فصل مستمع متأخر: {session.sid}")
+                    socketio.server.disconnect(session.sid)
+            emit_seconds.observe(time.perf_counter() - started)
+            self.record_latency(captured_at)
+
+        self.stats['listeners'] = len(self.listeners)
+
+    def emit_spectrum(self, pcm):
+        """إطار طيف مضغوط (بايت لكل نطاق) لغرفة لوحات التحكم"""
+        levels = self.spectrum.analyze(np.frombuffer(pcm, dtype=np.int16), RATE)
+        socketio.emit('spectrum', {'station': self.name, 'bands': levels.tobytes()},
+                      to=self.admin_room)
+        socket_emits.inc('spectrum')
+
+    def emit_stats(self):
+        """إرسال الإحصائيات كل 5 ثوان"""
+        current_time = time.time()
+        if current_time - self.last_stats_update < 5:
+            return
+        start_time = self.stats.get('start_time')
+        socketio.emit('stats_update', {
+            'station': self.name,
+            'listeners': self.stats['listeners'],
+            'data_sent': self.stats['data_sent'],
+            'uptime': int(current_time - start_time) if start_time else 0,
+            'latency_ms': self.stats['latency_ms']
+        })
+        socket_emits.inc('stats_update')
+        self.last_stats_update = current_time
+
+    def status(self):
+        current_time = time.time()
+        start_time = self.stats.get('start_time')
+        return {
+            'station': self.name,
+            'streaming_active': self.active,
+            'listeners': len(self.listeners),
+            'source': self.processor.source.name,
+            'uptime_seconds': int(current_time - start_time) if start_time else 0,
+            'data_sent_mb': round(self.stats['data_sent'] / (1024*1024), 2),
+            'capture_to_emit_ms': self.stats['latency_ms'],
+            'rooms': self.room_counts(),
+            'sessions': {sid: session.stats() for sid, session in list(self.listeners.items())},
+            'noise_reduction': self.processor.noise_suppressor.stats(),
+            'dynamics': self.processor.dynamics_stats(),
+            'pipeline': self.processor.pipeline_stats()
+        }
 
 # متغيرات عامة
 audio_processor = AudioProcessor()
 network_manager = NetworkManager()
 listeners = {}
-streaming_active = False
-server_stats = {"listeners": 0, "start_time": None, "data_sent": 0}
+fanout_condition = threading.Condition()  # يوقظ مستمعي HTTP بعد كل كتلة
+control_queue = None  # في وضع العمليات المتعددة: أحداث التحكم تُرسل لعملية الالتقاط
+relay_state = {'upstream': None, 'connected': False, 'reconnects': 0, 'upstream_seq': 0}
+socket_client_options = {}  # خيارات عميل Socket.IO في الصفحات
+archive_writer = None  # أرشيف البث عند تفعيل --archive
+latency_profile = DEFAULT_LATENCY_PROFILE
+segment_cache = SegmentCache()  # مقاطع HLS تُبنى في كل عملية من الكتل نفسها
+audio_processor.sinks.append(segment_cache)
+LISTENERS_ROOM = 'listeners'  # غرفة Socket.IO للمستمعين المشتركين فقط
+server_stats = {"listeners": 0, "http_listeners": 0, "start_time": None, "data_sent": 0,
+                "latency_ms": {"last": 0.0, "avg": 0.0, "max": 0.0}}
+fanout_pool = FanoutPool()
+stations = {}  # سجل المحطات بالاسم؛ الرئيسية تستخدم المعالج والإحصائيات العامة أعلاه
+
+def add_station(name, processor, **kwargs):
+    station = stations[name] = Station(name, processor, **kwargs)
+    return station
+
+def station_for(data):
+    """المحطة المطلوبة في بيانات الحدث (الرئيسية إن لم تُحدد)، أو None إن كانت غير معروفة"""
+    return stations.get((data or {}).get('station') or MAIN_STATION)
+
+def listener_station(sid):
+    """المحطة التي يستمع إليها العميل حالياً"""
+    for station in list(stations.values()):
+        if sid in station.listeners:
+            return station
+    return None
+
+main_station = add_station(MAIN_STATION, audio_processor, listeners=listeners, stats=server_stats)
+
+metrics.gauge('radio_queue_depth', "عدد الكتل المنتظرة في طابور البث",
+              lambda: sum(station.processor.audio_queue.qsize() for station in list(stations.values())))
+metrics.gauge('radio_listeners', "عدد مستمعي Socket.IO",
+              lambda: sum(len(station.listeners) for station in list(stations.values())))
+metrics.gauge('radio_stations', "عدد المحطات المسجلة", lambda: len(stations))
+metrics.gauge('radio_http_listeners', "عدد مستمعي HTTP", lambda: server_stats['http_listeners'])
+metrics.gauge('radio_archive_queue_depth', "عدد الكتل المنتظرة للكتابة في الأرشيف",
+              lambda: archive_writer.queue.qsize() if archive_writer else 0)
+
+def apply_latency_profile(name):
+    """تطبيق ملف زمن وصول بكل إعداداته على كل المحطات؛ يُعاد تشغيل الالتقاط إن كان يعمل"""
+    global CHUNK, RATE, LISTENER_QUEUE_SIZE, LISTENER_SEND_WINDOW, PREBUFFER_SECONDS, latency_profile
+    profile = LATENCY_PROFILES[name]
+    recording = [station.processor for station in stations.values() if station.processor.is_recording]
+    for processor in recording:
+        processor.stop_recording()
+    CHUNK, RATE = profile['chunk'], profile['rate']
+    LISTENER_QUEUE_SIZE = profile['listener_queue']
+    LISTENER_SEND_WINDOW = profile['send_window']
+    PREBUFFER_SECONDS = profile['prebuffer']
+    latency_profile = name
+    for station in stations.values():
+        station.processor.configure(RATE, CHUNK, profile['queue'])
+    segment_cache.configure(RATE)
+    if archive_writer:
+        archive_writer.rate = RATE
+    for processor in recording:
+        processor.start_recording()
+    return profile
+
+def apply_queue_policy(policy, max_lag_seconds):
+    """السياسة الافتراضية لطوابير المستمعين وحد التأخر لسياسة disconnect"""
+    global LISTENER_QUEUE_POLICY, LISTENER_MAX_LAG_SECONDS
+    if policy not in QUEUE_POLICIES:
+        raise ValueError(f"سياسة طابور غير معروفة: {policy}")
+    LISTENER_QUEUE_POLICY = policy
+    LISTENER_MAX_LAG_SECONDS = max_lag_seconds
+
+def stream_format(codec, tier=None):
+    """معاملات البث التي يحتاجها المشغل (تُرسل في stream_ready)"""
+    tier = tier or RATE
+    return {'sample_rate': tier, 'channels': CHANNELS, 'codec': codec, 'tier': tier,
+            'tiers': available_tiers(), 'chunk': CHUNK * tier // RATE,
+            'profile': latency_profile, 'prebuffer_seconds': PREBUFFER_SECONDS}
+
+def available_tiers():
+    """الطبقات التي لا تتجاوز معدل الالتقاط، ومعدل الالتقاط نفسه دائماً"""
+    return sorted({rate for rate in TIER_RATES if rate <= RATE} | {RATE})
+
+def pick_tier(requested):
+    """أعلى طبقة لا تتجاوز المطلوب (أو أدناها)؛ بدون طلب: معدل الالتقاط"""
+    tiers = available_tiers()
+    if not requested:
+        return RATE
+    fitting = [rate for rate in tiers if rate <= requested]
+    return fitting[-1] if fitting else tiers[0]
+
+def announce_stream_format():
+    """بعد تغيير معدل الالتقاط: إعادة توزيع المستمعين على الطبقات المتاحة وإبلاغ كل غرفة"""
+    for station in list(stations.values()):
+        for session in list(station.listeners.values()):
+            station.assign_stream(session, session.codec, pick_tier(session.requested_tier))
+        for tier in available_tiers():
+            for codec in CODECS:
+                socketio.emit('stream_ready', stream_format(codec, tier),
+                              to=station.stream_room(codec, tier))
 
 # صفحة الويب الرئيسية
 HTML_TEMPLATE = """
@@ -331,7 +2291,7 @@ HTML_TEMPLATE = """
 </head>
 <body>
     <div class="container">
-        <h1>🎙️ إذاعة صوتية مباشرة</h1>
+        <h1>🎙️ إذاعة صوتية مباشرة{% if station != main_station %} - {{ station }}{% endif %}</h1>
         
         <div class="controls">
             <div class="control-group">
@@ -351,9 +2311,28 @@ HTML_TEMPLATE = """
             <div class="control-group">
                 <h3>🎛️ فلاتر الصوت</h3>
                 <button id="noiseBtn" onclick="toggleNoise()">تقليل الضوضاء</button>
+                <button id="noiseProfileBtn" onclick="captureNoiseProfile()">التقاط بصمة الضوضاء</button>
                 <button id="lowPassBtn" onclick="toggleLowPass()">مرشح منخفض</button>
                 <button id="highPassBtn" onclick="toggleHighPass()">مرشح عالي</button>
             </div>
+            
+            <div class="control-group">
+                <h3>📈 الديناميكية</h3>
+                <button id="agcBtn" onclick="toggleDynamics('agc', this)">كسب آلي</button>
+                <button id="compressorBtn" onclick="toggleDynamics('compressor', this)">ضاغط</button>
+                <button id="limiterBtn" class="active" onclick="toggleDynamics('limiter', this)">محدد</button>
+            </div>
+            
+            <div class="control-group">
+                <h3>⏱️ ملف زمن الوصول</h3>
+                <select id="profileSelect" onchange="changeProfile(this.value)">
+                    {% for name, profile in profiles.items() %}
+                    <option value="{{ name }}" {% if name == current_profile %}selected{% endif %}>
+                        {{ name }} ({{ profile.chunk }} @ {{ profile.rate }} Hz)
+                    </option>
+                    {% endfor %}
+                </select>
+            </div>
         </div>
         
         <div class="audio-visualizer" id="visualizer"></div>
@@ -375,11 +2354,16 @@ HTML_TEMPLATE = """
                 <strong>البيانات المرسلة</strong><br>
                 <span id="dataSent">0 KB</span>
             </div>
+            <div class="stat-item">
+                <strong>التأخير حتى الإرسال</strong><br>
+                <span id="latency">0 ms</span>
+            </div>
         </div>
     </div>
 
     <script>
-        const socket = io();
+        const socket = io({{ socket_options | tojson }});
+        const STATION = {{ station | tojson }};
         let isStreaming = false;
         let startTime = null;
         let visualizerBars = [];
@@ -387,7 +2371,7 @@ HTML_TEMPLATE = """
         // إنشاء مصور الصوت
         function createVisualizer() {
             const visualizer = document.getElementById('visualizer');
-            for (let i = 0; i < 50; i++) {
+            for (let i = 0; i < {{ spectrum_bands }}; i++) {
                 const bar = document.createElement('div');
                 bar.className = 'wave-bar';
                 bar.style.left = (i * 6) + 'px';
@@ -397,38 +2381,43 @@ HTML_TEMPLATE = """
             }
         }
         
-        // تحديث مصور الصوت
-        function updateVisualizer() {
+        // تحديث مصور الصوت من مستويات النطاقات (0-255) المحسوبة في الخادم
+        function updateVisualizer(levels) {
             visualizerBars.forEach((bar, index) => {
-                const height = Math.random() * 40 + 2;
+                const height = (levels ? levels[index] : 0) / 255 * 46 + 2;
                 bar.style.height = height + 'px';
             });
         }
         
+        // كل أحداث التحكم موجهة لمحطة هذه الصفحة
+        function send(event, data) {
+            socket.emit(event, Object.assign({station: STATION}, data || {}));
+        }
+        
         // تبديل البث
         function toggleStreaming() {
             const btn = document.getElementById('startBtn');
             if (!isStreaming) {
-                socket.emit('start_stream');
+                send('start_stream');
                 btn.textContent = 'إيقاف البث';
                 btn.classList.add('active');
                 isStreaming = true;
                 startTime = Date.now();
                 updateStatus('البث مُفعل', true);
-                setInterval(updateVisualizer, 100);
             } else {
-                socket.emit('stop_stream');
+                send('stop_stream');
                 btn.textContent = 'بدء البث';
                 btn.classList.remove('active');
                 isStreaming = false;
                 updateStatus('البث متوقف', false);
+                updateVisualizer(null);
             }
         }
         
         // تبديل الكتم
         function toggleMute() {
             const btn = document.getElementById('muteBtn');
-            socket.emit('toggle_mute');
+            send('toggle_mute');
             btn.classList.toggle('active');
         }
         
@@ -436,30 +2425,46 @@ HTML_TEMPLATE = """
         function changeVolume(value) {
             const display = document.getElementById('volumeDisplay');
             display.textContent = value + '%';
-            socket.emit('change_volume', {volume: value / 100});
+            send('change_volume', {volume: value / 100});
         }
         
         // تبديل تقليل الضوضاء
         function toggleNoise() {
             const btn = document.getElementById('noiseBtn');
-            socket.emit('toggle_noise');
+            send('toggle_noise');
             btn.classList.toggle('active');
         }
         
+        // التقاط بصمة الضوضاء (يُفضل أثناء الصمت)
+        function captureNoiseProfile() {
+            send('capture_noise_profile', {seconds: 1.0});
+        }
+        
         // تبديل المرشح المنخفض
         function toggleLowPass() {
             const btn = document.getElementById('lowPassBtn');
-            socket.emit('toggle_low_pass');
+            send('toggle_low_pass');
             btn.classList.toggle('active');
         }
         
         // تبديل المرشح العالي
         function toggleHighPass() {
             const btn = document.getElementById('highPassBtn');
-            socket.emit('toggle_high_pass');
+            send('toggle_high_pass');
             btn.classList.toggle('active');
         }
         
+        // تبديل مراحل الديناميكية (agc | compressor | limiter)
+        function toggleDynamics(stage, btn) {
+            send('toggle_' + stage);
+            btn.classList.toggle('active');
+        }
+        
+        // تغيير ملف زمن الوصول (حجم الكتلة والمعدل والطوابير)
+        function changeProfile(name) {
+            socket.emit('set_latency_profile', {profile: name});
+        }
+        
         // تحديث الحالة
         function updateStatus(message, isLive) {
             const status = document.getElementById('status');
@@ -484,16 +2489,37 @@ HTML_TEMPLATE = """
         
         // استقبال الأحداث
         socket.on('stats_update', function(data) {
+            if (data.station !== STATION) return;
             document.getElementById('listeners').textContent = data.listeners;
             document.getElementById('dataSent').textContent = Math.round(data.data_sent / 1024) + ' KB';
+            if (data.latency_ms) {
+                document.getElementById('latency').textContent = Math.round(data.latency_ms.avg) + ' ms';
+            }
+        });
+        
+        socket.on('spectrum', function(data) {
+            if (data.station !== STATION) return;
+            updateVisualizer(new Uint8Array(data.bands));
         });
         
-        socket.on('stream_started', function() {
+        // الاشتراك في الطيف يُعاد مع كل اتصال (الغرف لا تبقى بعد انقطاعه)
+        socket.on('connect', function() {
+            send('join_admin');
+        });
+        
+        socket.on('latency_profile', function(data) {
+            document.getElementById('profileSelect').value = data.profile;
+        });
+        
+        socket.on('stream_started', function(data) {
+            if (data.station !== STATION) return;
             updateStatus('البث مُفعل', true);
         });
         
-        socket.on('stream_stopped', function() {
+        socket.on('stream_stopped', function(data) {
+            if (data.station !== STATION) return;
             updateStatus('البث متوقف', false);
+            updateVisualizer(null);
         });
         
         // تهيئة الصفحة
@@ -599,12 +2625,26 @@ LISTEN_TEMPLATE = """
 </head>
 <body>
     <div class="player">
-        <h1>🎵 الاستماع للإذاعة</h1>
+        <h1>🎵 الاستماع للإذاعة{% if station != main_station %} - {{ station }}{% endif %}</h1>
         
         <button class="play-button" id="playBtn" onclick="togglePlay()">
             ▶️ تشغيل
         </button>
         
+        <div class="volume-control">
+            <span>📶 جودة الاتصال:</span>
+            <select id="codecSelect">
+                <option value="pcm16">عالية (PCM)</option>
+                <option value="mulaw">متوسطة (μ-law)</option>
+                <option value="adpcm">للجوال (ADPCM)</option>
+            </select>
+            <select id="tierSelect">
+                {% for tier in tiers %}
+                <option value="{{ tier }}" {% if loop.last %}selected{% endif %}>{{ tier / 1000 }} kHz</option>
+                {% endfor %}
+            </select>
+        </div>
+        
         <div class="volume-control">
             <span>🔊 مستوى الصوت:</span>
             <input type="range" min="0" max="100" value="50" class="volume-slider" id="volumeSlider" oninput="changeVolume(this.value)">
@@ -628,13 +2668,83 @@ LISTEN_TEMPLATE = """
     </div>
 
     <script>
-        const socket = io();
+        const socket = io({{ socket_options | tojson }});
+        const STATION = {{ station | tojson }};
         let audioContext;
         let audioBuffer = [];
         let isPlaying = false;
         let currentSource;
         let gainNode;
         let nextTime = 0;
+        let codec = 'pcm16';
+        let sampleRate = 22050;  // يُحدَّث من stream_ready
+        
+        // جداول فك ترميز μ-law و IMA-ADPCM
+        const MULAW_TABLE = new Float32Array(256);
+        for (let i = 0; i < 256; i++) {
+            const code = ~i & 0xff;
+            const exponent = (code >> 4) & 0x07;
+            const magnitude = ((((code & 0x0f) << 3) + 0x84) << exponent) - 0x84;
+            MULAW_TABLE[i] = ((code & 0x80) ? -magnitude : magnitude) / 32768.0;
+        }
+        const IMA_STEPS = [7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+            50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+            253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+            1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+            3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+            11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767];
+        const IMA_INDEX = [-1, -1, -1, -1, 2, 4, 6, 8];
+        const ADPCM_BLOCK = 128;
+        
+        function decodePcm16(data) {
+            const int16Array = new Int16Array(data);
+            const float32Array = new Float32Array(int16Array.length);
+            for (let i = 0; i < int16Array.length; i++) {
+                float32Array[i] = int16Array[i] / 32768.0;
+            }
+            return float32Array;
+        }
+        
+        function decodeMuLaw(data) {
+            const bytes = new Uint8Array(data);
+            const float32Array = new Float32Array(bytes.length);
+            for (let i = 0; i < bytes.length; i++) {
+                float32Array[i] = MULAW_TABLE[bytes[i]];
+            }
+            return float32Array;
+        }
+        
+        function decodeAdpcm(data) {
+            const view = new DataView(data);
+            const bytes = new Uint8Array(data);
+            const total = view.getUint32(0, true);
+            const float32Array = new Float32Array(total);
+            let offset = 4;
+            let o = 0;
+            while (o < total) {
+                let predictor = view.getInt16(offset, true);
+                let index = bytes[offset + 2];
+                offset += 4;
+                float32Array[o++] = predictor / 32768.0;
+                for (let i = 0; i < ADPCM_BLOCK - 1 && o < total; i++) {
+                    const packed = bytes[offset + (i >> 1)];
+                    const code = (i & 1) ? (packed >> 4) : (packed & 0x0f);
+                    const step = IMA_STEPS[index];
+                    let delta = step >> 3;
+                    if (code & 4) delta += step;
+                    if (code & 2) delta += step >> 1;
+                    if (code & 1) delta += step >> 2;
+                    predictor += (code & 8) ? -delta : delta;
+                    predictor = Math.max(-32768, Math.min(32767, predictor));
+                    index = Math.max(0, Math.min(88, index + IMA_INDEX[code & 7]));
+                    float32Array[o++] = predictor / 32768.0;
+                }
+                offset += ADPCM_BLOCK / 2;
+            }
+            return float32Array;
+        }
+        
+        const DECODERS = {pcm16: decodePcm16, mulaw: decodeMuLaw, adpcm: decodeAdpcm};
         
         function initAudio() {
             try {
@@ -642,7 +2752,7 @@ LISTEN_TEMPLATE = """
                 gainNode = audioContext.createGain();
                 gainNode.connect(audioContext.destination);
                 gainNode.gain.value = 0.5;
-                nextTime = audioContext.currentTime;
+                nextTime = 0;
                 return true;
             } catch (e) {
                 console.error('خطأ في تهيئة الصوت:', e);
@@ -660,7 +2770,9 @@ LISTEN_TEMPLATE = """
                     btn.classList.add('playing');
                     isPlaying = true;
                     equalizer.style.display = 'flex';
-                    socket.emit('join_listeners');
+                    codec = document.getElementById('codecSelect').value;
+                    const tier = parseInt(document.getElementById('tierSelect').value);
+                    socket.emit('join_listeners', {station: STATION, codec: codec, tier: tier});
                     updateStatus('جاري الاستماع...');
                 }
             } else {
@@ -676,6 +2788,19 @@ LISTEN_TEMPLATE = """
             }
         }
         
+        // الطبقات تتغير مع ملف زمن الوصول في الخادم
+        function updateTiers(tiers, current) {
+            const select = document.getElementById('tierSelect');
+            select.innerHTML = '';
+            tiers.forEach(function(tier) {
+                const option = document.createElement('option');
+                option.value = tier;
+                option.textContent = (tier / 1000) + ' kHz';
+                option.selected = tier === current;
+                select.appendChild(option);
+            });
+        }
+        
         function changeVolume(value) {
             document.getElementById('volumeValue').textContent = value + '%';
             if (gainNode) {
@@ -687,28 +2812,18 @@ LISTEN_TEMPLATE = """
             document.getElementById('status').textContent = `حالة الاتصال: ${message}`;
         }
         
-        socket.on('audio_data', function(data) {
+        socket.on('audio_data', function(frame, ack) {
+            // الإقرار بالاستلام يفتح نافذة الإرسال للإطارات التالية
+            if (ack) {
+                ack(frame.seq);
+            }
             if (isPlaying && audioContext) {
                 try {
-                    // تحويل base64 إلى ArrayBuffer
-                    const binaryString = atob(data);
-                    const arrayBuffer = new ArrayBuffer(binaryString.length);
-                    const uint8Array = new Uint8Array(arrayBuffer);
-                    
-                    for (let i = 0; i < binaryString.length; i++) {
-                        uint8Array[i] = binaryString.charCodeAt(i);
-                    }
-                    
-                    // تحويل إلى Float32Array
-                    const int16Array = new Int16Array(arrayBuffer);
-                    const float32Array = new Float32Array(int16Array.length);
-                    
-                    for (let i = 0; i < int16Array.length; i++) {
-                        float32Array[i] = int16Array[i] / 32768.0;
-                    }
+                    // الإطار يصل ArrayBuffer ثنائياً ويُفك حسب الترميز المتفق عليه
+                    const float32Array = DECODERS[codec](frame.data);
                     
                     // إنشاء AudioBuffer
-                    const audioBuffer = audioContext.createBuffer(1, float32Array.length, 22050);
+                    const audioBuffer = audioContext.createBuffer(1, float32Array.length, sampleRate);
                     audioBuffer.getChannelData(0).set(float32Array);
                     
                     // تشغيل الصوت بتوقيت محدد
@@ -716,6 +2831,10 @@ LISTEN_TEMPLATE = """
                     source.buffer = audioBuffer;
                     source.connect(gainNode);
                     
+                    // نفاد البفر: الإطار وصل بعد انتهاء تشغيل السابق
+                    if (nextTime > 0 && nextTime < audioContext.currentTime) {
+                        socket.emit('player_underrun');
+                    }
                     const playTime = Math.max(nextTime, audioContext.currentTime);
                     source.start(playTime);
                     nextTime = playTime + audioBuffer.duration;
@@ -726,6 +2845,18 @@ LISTEN_TEMPLATE = """
             }
         });
         
+        socket.on('stream_ready', function(data) {
+            codec = data.codec || 'pcm16';
+            if (data.tiers) {
+                updateTiers(data.tiers, data.tier);
+            }
+            if (data.sample_rate && data.sample_rate !== sampleRate) {
+                // تغيّر الملف: جدولة الإطارات من جديد بالمعدل الجديد
+                sampleRate = data.sample_rate;
+                nextTime = 0;
+            }
+        });
+        
         socket.on('stream_status', function(data) {
             if (data.active) {
                 updateStatus('البث مُفعل');
@@ -747,213 +2878,750 @@ LISTEN_TEMPLATE = """
 """
 
 # المسارات
+def station_socket_options(name):
+    """خيارات العميل مع اسم المحطة في استعلام الاتصال (يقرأه حدث connect)"""
+    return dict(socket_client_options, query={'station': name})
+
 @app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
+@app.route('/admin/<station>')
+def index(station=MAIN_STATION):
+    if station not in stations:
+        return "المحطة غير موجودة", 404
+    return render_template_string(HTML_TEMPLATE, socket_options=station_socket_options(station),
+                                  profiles=LATENCY_PROFILES, current_profile=latency_profile,
+                                  station=station, main_station=MAIN_STATION,
+                                  spectrum_bands=SPECTRUM_BANDS)
 
 @app.route('/listen')
-def listen():
-    return render_template_string(LISTEN_TEMPLATE)
+@app.route('/listen/<station>')
+def listen(station=MAIN_STATION):
+    if station not in stations:
+        return "المحطة غير موجودة", 404
+    return render_template_string(LISTEN_TEMPLATE, socket_options=station_socket_options(station),
+                                  tiers=available_tiers(), station=station, main_station=MAIN_STATION)
+
+def wav_stream_header(rate=None, channels=CHANNELS):
+    """ترويسة WAV لبث مستمر بطول غير معروف"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate or RATE)
+    header = bytearray(buffer.getvalue())
+    # أقصى طول ممكن حتى يستمر المشغل بالقراءة دون توقف
+    struct.pack_into('<I', header, 4, 0xFFFFFFFF)
+    struct.pack_into('<I', header, 40, 0xFFFFFFFF - 36)
+    return bytes(header)
+
+def follow_ring(last_seq=None):
+    """مولّد يتبع الحلقة المشتركة ويعيد (seq، وقت الالتقاط، شريحة)، وينتهي بتوقف البث"""
+    ring = audio_processor.ring
+    if last_seq is None or last_seq > ring.seq:
+        # البداية من الدفعة الأولية (أو رقم من تشغيل سابق للخادم)
+        recent = ring.recent(PREBUFFER_SECONDS)
+        last_seq = recent[0][0] - 1 if recent else ring.seq
+    while True:
+        # الانتظار على شرط خيط البث (أخضر في وضع eventlet) لا على قفل الحلقة
+        with fanout_condition:
+            if ring.seq <= last_seq:
+                fanout_condition.wait(timeout=1.0)
+        chunks = ring.chunks_after(last_seq)
+        if not chunks and not main_station.active:
+            return
+        for chunk in chunks:
+            last_seq = chunk[0]
+            yield chunk
+
+def http_audio_stream(header=b''):
+    """مولّد يقرأ من الحلقة المشتركة مباشرة دون أحداث Socket.IO"""
+    server_stats['http_listeners'] += 1
+    rate = RATE
+    try:
+        if header:
+            yield header
+        for _, _, view in follow_ring():
+            if RATE != rate:
+                return  # تغيّر ملف زمن الوصول: يعيد المشغل الاتصال برأس جديد
+            server_stats['data_sent'] += len(view)
+            yield bytes(view)
+    finally:
+        server_stats['http_listeners'] -= 1
+
+def http_stream_response(header, mimetype):
+    if not main_station.active:
+        return jsonify({'error': 'البث متوقف'}), 503
+    response = Response(http_audio_stream(header), mimetype=mimetype, direct_passthrough=True)
+    response.headers['Cache-Control'] = 'no-cache, no-store'
+    return response
+
+# إطار الترحيل: رقم التسلسل، وقت الالتقاط، طول البيانات
+RELAY_FRAME = struct.Struct('<QdI')
+
+def relay_feed_stream(since):
+    rate = RATE
+    for seq, captured_at, view in follow_ring(since):
+        if RATE != rate:
+            return  # الخادم الطرفي يعيد الاتصال ويقرأ الملف الجديد
+        server_stats['data_sent'] += len(view)
+        yield RELAY_FRAME.pack(seq, captured_at, len(view)) + bytes(view)
+
+@app.route('/relay')
+def relay_feed():
+    """اتصال واحد مستمر لكل خادم طرفي؛ since يسمح بالاستئناف بعد الانقطاع"""
+    if not main_station.active:
+        return jsonify({'error': 'البث متوقف'}), 503
+    since = request.args.get('since', type=int)
+    response = Response(relay_feed_stream(since), mimetype='application/octet-stream',
+                        direct_passthrough=True)
+    response.headers['Cache-Control'] = 'no-cache, no-store'
+    return response
+
+@app.route('/stream.wav')
+def stream_wav():
+    return http_stream_response(wav_stream_header(), 'audio/wav')
+
+@app.route('/stream.pcm')
+def stream_pcm():
+    # PCM خام s16le أحادي القناة بمعدل RATE
+    return http_stream_response(b'', 'application/octet-stream')
+
+@app.route('/hls/live.m3u8')
+def hls_playlist():
+    playlist, etag = segment_cache.playlist()
+    response = Response(playlist, mimetype='application/vnd.apple.mpegurl')
+    response.set_etag(etag)
+    # القائمة تتغير مع كل مقطع: تخزين مؤقت قصير يكفي لامتصاص الطلبات المتزامنة
+    response.cache_control.public = True
+    response.cache_control.max_age = max(1, int(HLS_SEGMENT_SECONDS / 2))
+    return response.make_conditional(request)
+
+@app.route('/hls/<int:seq>.wav')
+def hls_segment(seq):
+    segment = segment_cache.get(seq)
+    if segment is None:
+        return Response("المقطع غير متوفر", status=404, mimetype='text/plain')
+    response = Response(segment.data, mimetype='audio/wav')
+    response.set_etag(segment.etag)
+    # المقطع لا يتغير بعد نشره
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/status')
 def status():
     public_ip = network_manager.get_public_ip()
     local_ip = network_manager.get_local_ip()
-    current_time = time.time()
-    uptime = int(current_time - server_stats.get('start_time', current_time)) if server_stats.get('start_time') else 0
     
     return jsonify({
         'public_ip': public_ip,
         'local_ip': local_ip,
-        'streaming_active': streaming_active,
-        'listeners': len(listeners),
-        'uptime_seconds': uptime,
-        'data_sent_mb': round(server_stats['data_sent'] / (1024*1024), 2)
+        **main_station.status(),
+        'http_listeners': server_stats['http_listeners'],
+        'pid': os.getpid(),
+        'config': {'profile': latency_profile, 'chunk': CHUNK, 'rate': RATE,
+                   'async_mode': ASYNC_MODE, 'source': audio_processor.source.name,
+                   'listener_queue': LISTENER_QUEUE_SIZE, 'send_window': LISTENER_SEND_WINDOW,
+                   'prebuffer_seconds': PREBUFFER_SECONDS},
+        'relay': relay_state if relay_state['upstream'] else None,
+        'archive': archive_writer.stats() if archive_writer else None,
+        'hls': segment_cache.stats(),
+        'queue_policy': LISTENER_QUEUE_POLICY,
+        'max_lag_seconds': LISTENER_MAX_LAG_SECONDS,
+        'stations': {name: {'streaming_active': station.active, 'listeners': len(station.listeners),
+                            'source': station.processor.source.name}
+                     for name, station in list(stations.items())}
     })
 
+@app.route('/status/<station>')
+def station_status(station):
+    if station not in stations:
+        return jsonify({'error': 'المحطة غير موجودة'}), 404
+    return jsonify(stations[station].status())
+
+def on_event(event):
+    """socketio.on مع عدّاد لكل نوع حدث مستلم"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def counted(*args):
+            # العدّ بعد النجاح: Flask-SocketIO يعيد المحاولة بلا وسائط عند TypeError
+            result = handler(*args)
+            socket_events.inc(event)
+            return result
+        return socketio.on(event)(counted)
+    return decorator
+
 # أحداث WebSocket
-@socketio.on('connect')
+@on_event('connect')
 def handle_connect():
     print(f"عميل جديد متصل: {request.sid}")
-    emit('stream_status', {'active': streaming_active})
+    station = station_for(request.args) or main_station
+    emit('stream_status', {'active': station.active, 'station': station.name})
 
-@socketio.on('disconnect')
+@on_event('disconnect')
 def handle_disconnect():
-    if request.sid in listeners:
-        del listeners[request.sid]
+    station = listener_station(request.sid)
+    if station:
+        del station.listeners[request.sid]
+    for station in list(stations.values()):
+        station.admins.discard(request.sid)
     print(f"عميل منقطع: {request.sid}")
 
-@socketio.on('start_stream')
-def handle_start_stream():
-    global streaming_active
-    if audio_processor.start_recording():
-        streaming_active = True
-        server_stats['start_time'] = time.time()
-        emit('stream_started', broadcast=True)
-        print("تم بدء البث")
+def forward_control(event, data=None):
+    """في وضع العمليات المتعددة تُطبَّق أحداث التحكم في عملية الالتقاط"""
+    if relay_state['upstream']:
+        emit('error', {'message': 'هذا خادم ترحيل: التحكم من الخادم الأصلي'})
+        return True
+    if control_queue is None:
+        return False
+    control_queue.put((event, data))
+    return True
+
+def control_station(data):
+    """المحطة التي يستهدفها حدث تحكم؛ خطأ للعميل إن كانت غير معروفة"""
+    station = station_for(data)
+    if station is None:
+        emit('error', {'message': f"محطة غير معروفة: {data.get('station')}"})
+    return station
+
+@on_event('start_stream')
+def handle_start_stream(data=None):
+    if forward_control('start_stream', data):
+        return
+    station = control_station(data)
+    if station is None:
+        return
+    if station.start():
+        emit('stream_started', {'station': station.name}, broadcast=True)
+        print(f"تم بدء البث ({station.name})")
     else:
         emit('error', {'message': 'فشل في بدء البث'})
 
-@socketio.on('stop_stream')
-def handle_stop_stream():
-    global streaming_active
-    audio_processor.stop_recording()
-    streaming_active = False
-    emit('stream_stopped', broadcast=True)
-    print("تم إيقاف البث")
+@on_event('stop_stream')
+def handle_stop_stream(data=None):
+    if forward_control('stop_stream', data):
+        return
+    station = control_station(data)
+    if station is None:
+        return
+    station.stop()
+    emit('stream_stopped', {'station': station.name}, broadcast=True)
+    print(f"تم إيقاف البث ({station.name})")
+
+def toggle_stage(event, data, attribute, label):
+    """تبديل إعداد معالجة ثم إعادة بناء السلسلة مرة واحدة"""
+    if forward_control(event, data):
+        return
+    station = control_station(data)
+    if station is None:
+        return
+    processor = station.processor
+    setattr(processor, attribute, not getattr(processor, attribute))
+    processor.rebuild_pipeline()
+    print(f"{label} ({station.name}): {'مُفعل' if getattr(processor, attribute) else 'معطل'}")
 
-@socketio.on('toggle_mute')
-def handle_toggle_mute():
-    audio_processor.muted = not audio_processor.muted
-    print(f"كتم الصوت: {'مُفعل' if audio_processor.muted else 'معطل'}")
+@on_event('toggle_mute')
+def handle_toggle_mute(data=None):
+    toggle_stage('toggle_mute', data, 'muted', 'كتم الصوت')
 
-@socketio.on('change_volume')
+@on_event('change_volume')
 def handle_change_volume(data):
-    audio_processor.volume = data['volume']
-    print(f"تغيير مستوى الصوت إلى: {data['volume']}")
-
-@socketio.on('toggle_noise')
-def handle_toggle_noise():
-    audio_processor.noise_reduction = not audio_processor.noise_reduction
-    print(f"تقليل الضوضاء: {'مُفعل' if audio_processor.noise_reduction else 'معطل'}")
-
-@socketio.on('toggle_low_pass')
-def handle_toggle_low_pass():
-    audio_processor.low_pass_filter = not audio_processor.low_pass_filter
-    print(f"المرشح المنخفض: {'مُفعل' if audio_processor.low_pass_filter else 'معطل'}")
-
-@socketio.on('toggle_high_pass')
-def handle_toggle_high_pass():
-    audio_processor.high_pass_filter = not audio_processor.high_pass_filter
-    print(f"المرشح العالي: {'مُفعل' if audio_processor.high_pass_filter else 'معطل'}")
-
-@socketio.on('join_listeners')
-def handle_join_listeners():
-    listeners[request.sid] = {
-        'joined_at': time.time(),
-        'buffer': deque(maxlen=10)
-    }
-    print(f"مستمع جديد: {request.sid}")
+    if forward_control('change_volume', data):
+        return
+    station = control_station(data)
+    if station is None:
+        return
+    station.processor.volume = data['volume']
+    station.processor.rebuild_pipeline()
+    print(f"تغيير مستوى الصوت ({station.name}) إلى: {data['volume']}")
+
+@on_event('toggle_noise')
+def handle_toggle_noise(data=None):
+    if forward_control('toggle_noise', data):
+        return
+    station = control_station(data)
+    if station is None:
+        return
+    processor = station.processor
+    processor.set_noise_reduction(not processor.noise_reduction)
+    print(f"تقليل الضوضاء ({station.name}): {'مُفعل' if processor.noise_reduction else 'معطل'}")
+    if (processor.noise_reduction and processor.noise_suppressor.noise_profile is None
+            and has_request_context()):
+        emit('error', {'message': 'لا توجد بصمة ضوضاء بعد: التقطها أثناء الصمت ليبدأ التقليل'})
+
+@on_event('capture_noise_profile')
+def handle_capture_noise_profile(data=None):
+    if forward_control('capture_noise_profile', data):
+        return
+    station = control_station(data)
+    if station is None:
+        return
+    seconds = float((data or {}).get('seconds', 1.0))
+    station.processor.capture_noise_profile(seconds)
+    print(f"جاري التقاط بصمة الضوضاء ({station.name}) لمدة {seconds} ثانية")
+
+@on_event('toggle_low_pass')
+def handle_toggle_low_pass(data=None):
+    toggle_stage('toggle_low_pass', data, 'low_pass_filter', 'المرشح المنخفض')
+
+@on_event('set_latency_profile')
+def handle_set_latency_profile(data):
+    name = (data or {}).get('profile')
+    if name not in LATENCY_PROFILES:
+        emit('error', {'message': f'ملف غير معروف: {name}'})
+        return
+    if control_queue is not None or relay_state['upstream']:
+        # العمليات الأخرى تحتاج إعادة تشغيل بالملف الجديد (--profile)
+        emit('error', {'message': 'تغيير الملف أثناء التشغيل غير مدعوم في هذا الوضع'})
+        return
+    apply_latency_profile(name)
+    announce_stream_format()
+    emit('latency_profile', {'profile': name, **LATENCY_PROFILES[name]}, broadcast=True)
+    print(f"⏱️ ملف زمن الوصول: {name} ({CHUNK} عينة @ {RATE} Hz)")
+
+@on_event('toggle_high_pass')
+def handle_toggle_high_pass(data=None):
+    toggle_stage('toggle_high_pass', data, 'high_pass_filter', 'المرشح العالي')
+
+@on_event('toggle_agc')
+def handle_toggle_agc(data=None):
+    toggle_stage('toggle_agc', data, 'agc_enabled', 'الكسب الآلي')
+
+@on_event('toggle_compressor')
+def handle_toggle_compressor(data=None):
+    toggle_stage('toggle_compressor', data, 'compressor_enabled', 'الضاغط')
+
+@on_event('toggle_limiter')
+def handle_toggle_limiter(data=None):
+    toggle_stage('toggle_limiter', data, 'limiter_enabled', 'المحدد')
+
+@on_event('join_listeners')
+def handle_join_listeners(data=None):
+    data = data or {}
+    station = control_station(data)
+    if station is None:
+        return
+    codec = data.get('codec', DEFAULT_CODEC)
+    if codec not in CODECS:
+        codec = DEFAULT_CODEC
+    try:
+        requested_tier = int(data['tier']) if data.get('tier') else None
+    except (TypeError, ValueError):
+        requested_tier = None
+    tier = pick_tier(requested_tier)
+    # العميل قد يطلب سياسة طابور أخرى؛ القيمة غير المعروفة تعود للافتراضية
+    policy = data.get('policy')
+    if policy not in QUEUE_POLICIES:
+        policy = None
+    # العميل يستمع لمحطة واحدة في كل مرة
+    previous_station = listener_station(request.sid)
+    if previous_station:
+        previous = previous_station.listeners.pop(request.sid)
+        leave_room(previous_station.stream_room(previous.codec, previous.tier))
+        leave_room(previous_station.room)
+    join_room(station.room)
+    join_room(station.stream_room(codec, tier))
     
     # إرسال إشارة بدء التشغيل
-    emit('stream_ready', {'sample_rate': RATE, 'channels': CHANNELS})
+    emit('stream_ready', stream_format(codec, tier))
+    
+    # دفعة أولية من آخر الصوت في الحلقة حتى يبدأ التشغيل فوراً وبهامش أمان
+    session = ListenerSession(request.sid, codec, station.send_frame, policy=policy,
+                              tier=tier, requested_tier=requested_tier)
+    # قفل التوزيع نفسه: كل كتلة إما داخل الدفعة الأولية أو تصل بعد التسجيل،
+    # فلا تضيع كتلة توزَّع بين قراءة الحلقة وإضافة الجلسة
+    with station.lock:
+        if station.active:
+            recent = station.processor.ring.recent(PREBUFFER_SECONDS)
+            if recent:
+                pcm = b''.join(view for _, _, view in recent)
+                if tier != RATE:
+                    # معيد مؤقت للدفعة فقط حتى لا تختل حالة معيد خيط البث
+                    resampler = StreamingResampler(RATE, tier)
+                    pcm = clip_to_int16(resampler.process(np.frombuffer(pcm, dtype=np.int16)))
+                session.push({'seq': recent[-1][0], 'ts': recent[-1][1], 'prebuffer': True,
+                              'data': CODECS[codec].encode(pcm)})
+        station.listeners[request.sid] = session
+    print(f"مستمع جديد: {request.sid} ({station.name}، {codec} @ {tier} Hz)")
+
+@on_event('join_admin')
+def handle_join_admin(data=None):
+    """لوحة التحكم تشترك في إطارات الطيف لمحطتها"""
+    station = control_station(data)
+    if station is None:
+        return
+    join_room(station.admin_room)
+    station.admins.add(request.sid)
 
-@socketio.on('leave_listeners')
-def handle_leave_listeners():
-    if request.sid in listeners:
-        del listeners[request.sid]
+@on_event('leave_listeners')
+def handle_leave_listeners(data=None):
+    station = listener_station(request.sid)
+    if station:
+        session = station.listeners.pop(request.sid)
+        leave_room(station.stream_room(session.codec, session.tier))
+        leave_room(station.room)
     print(f"مستمع غادر: {request.sid}")
 
-# تحديث دالة البث لتكون أكثر كفاءة
-def audio_streaming_thread():
-    """خيط بث الصوت محسن"""
-    last_stats_update = 0
-    audio_buffer = deque(maxlen=5)  # بفر إضافي
-    
+@on_event('player_underrun')
+def handle_player_underrun(data=None):
+    player_underruns.inc()
+    station = listener_station(request.sid)
+    session = station.listeners.get(request.sid) if station else None
+    if session:
+        session.underruns += 1
+
+# أحداث التحكم التي تطبقها عملية الالتقاط نيابة عن عمليات النقل
+CONTROL_HANDLERS = {
+    'toggle_mute': handle_toggle_mute,
+    'change_volume': handle_change_volume,
+    'toggle_noise': handle_toggle_noise,
+    'capture_noise_profile': handle_capture_noise_profile,
+    'toggle_low_pass': handle_toggle_low_pass,
+    'toggle_high_pass': handle_toggle_high_pass,
+    'toggle_agc': handle_toggle_agc,
+    'toggle_compressor': handle_toggle_compressor,
+    'toggle_limiter': handle_toggle_limiter,
+}
+
+def set_streaming_state(active):
+    """مزامنة حالة البث المحلية للمحطة الرئيسية (تستخدمها عمليات النقل)"""
+    if active == main_station.active:
+        return
+    main_station.active = active
+    if active:
+        server_stats['start_time'] = time.time()
+        socketio.emit('stream_started', {'station': MAIN_STATION})
+    else:
+        audio_processor.stop_recording()
+        socketio.emit('stream_stopped', {'station': MAIN_STATION})
+
+def run_server(host, port, reuse_port=False):
+    """تشغيل خادم الويب؛ مع reuse_port تتشارك عدة عمليات المنفذ نفسه (SO_REUSEPORT)"""
+    if not reuse_port:
+        run_options = {'allow_unsafe_werkzeug': True} if ASYNC_MODE == 'threading' else {}
+        socketio.run(app, host=host, port=port, debug=False, **run_options)
+    elif ASYNC_MODE == 'eventlet':
+        import eventlet.wsgi
+        eventlet.wsgi.server(eventlet.listen((host, port), reuse_port=True), app, log_output=False)
+    else:
+        from werkzeug.serving import make_server
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(128)
+        make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+
+def shared_ring_reader(ring, notify):
+    """خيط عملية النقل: ينقل الكتل من الذاكرة المشتركة إلى الحلقة المحلية"""
+    last_seq = ring.seq
+
+    def wait_for_chunk():
+        with notify:
+            if ring.seq <= last_seq:
+                notify.wait(1.0)
+
     while True:
-        if streaming_active and audio_processor.is_recording:
-            try:
-                audio_data = audio_processor.get_audio_chunk()
-                if audio_data:
-                    # إضافة البيانات للبفر
-                    audio_buffer.append(audio_data)
-                    
-                    # إرسال البيانات إذا كان هناك مستمعين
-                    if len(listeners) > 0 and audio_buffer:
-                        # أخذ البيانات من البفر
-                        data_to_send = audio_buffer.popleft()
-                        
-                        # تحويل البيانات إلى base64
-                        audio_b64 = base64.b64encode(data_to_send).decode('utf-8')
-                        
-                        # إرسال البيانات لجميع المستمعين دفعة واحدة
-                        if listeners:
-                            socketio.emit('audio_data', audio_b64, room=None)
-                        
-                        # تحديث الإحصائيات
-                        server_stats['data_sent'] += len(data_to_send)
-                        server_stats['listeners'] = len(listeners)
-                        
-                        # إرسال الإحصائيات كل 5 ثوان
-                        current_time = time.time()
-                        if current_time - last_stats_update >= 5:
-                            stats_to_send = {
-                                'listeners': server_stats['listeners'],
-                                'data_sent': server_stats['data_sent'],
-                                'uptime': int(current_time - server_stats.get('start_time', current_time)) if server_stats.get('start_time') else 0
-                            }
-                            socketio.emit('stats_update', stats_to_send)
-                            last_stats_update = current_time
-                            
-            except Exception as e:
-                print(f"خطأ في خيط البث: {e}")
-        
-        time.sleep(0.02)  # تقليل التأخير
+        run_blocking(wait_for_chunk)
+        set_streaming_state(ring.active)
+        latest = ring.seq
+        # إذا تأخرت العملية أكثر من طول الحلقة نقفز إلى أقدم خانة صالحة
+        for seq in range(max(last_seq + 1, latest - ring.slots + 1), latest + 1):
+            chunk = ring.read(seq)
+            if chunk is not None and main_station.active:
+                captured_at, payload = chunk
+                audio_processor.publish(np.frombuffer(payload, dtype=np.int16), captured_at)
+        last_seq = latest
 
-def print_server_info():
+def read_exact(stream, size):
+    data = b''
+    while len(data) < size:
+        part = stream.read(size - len(data))
+        if not part:
+            raise EOFError("انتهى اتصال الخادم الأصلي")
+        data += part
+    return data
+
+def sync_upstream_profile(upstream):
+    """اعتماد ملف زمن الوصول الخاص بالخادم الأصلي حتى يطابق المعدل الكتل المرحّلة"""
+    try:
+        config = requests.get(f"{upstream.rstrip('/')}/status", timeout=5).json().get('config') or {}
+    except (requests.RequestException, ValueError):
+        return
+    profile = config.get('profile')
+    if profile in LATENCY_PROFILES and profile != latency_profile:
+        apply_latency_profile(profile)
+        announce_stream_format()
+        print(f"⏱️ ملف زمن الوصول من الخادم الأصلي: {profile}")
+
+def relay_client(upstream):
+    """وضع الترحيل: اتصال واحد مستمر بالخادم الأصلي وإعادة بث كتله عبر المسار نفسه"""
+    relay_state['upstream'] = upstream
+    backoff = 1.0
+    while True:
+        try:
+            # الخادم الأصلي ينهي التغذية عند تغيير ملفه، فنعيد المزامنة مع كل اتصال
+            sync_upstream_profile(upstream)
+            params = {'since': relay_state['upstream_seq']} if relay_state['upstream_seq'] else {}
+            with requests.get(f"{upstream.rstrip('/')}/relay", params=params,
+                              stream=True, timeout=(5, 10)) as response:
+                response.raise_for_status()
+                relay_state['connected'] = True
+                backoff = 1.0
+                print(f"🔗 متصل بالخادم الأصلي: {upstream}")
+                while True:
+                    seq, captured_at, length = RELAY_FRAME.unpack(
+                        read_exact(response.raw, RELAY_FRAME.size))
+                    payload = read_exact(response.raw, length)
+                    relay_state['upstream_seq'] = seq
+                    set_streaming_state(True)
+                    audio_processor.publish(np.frombuffer(payload, dtype=np.int16), captured_at)
+        except Exception as e:
+            print(f"خطأ في اتصال الترحيل: {e}")
+        relay_state['connected'] = False
+        relay_state['reconnects'] += 1
+        set_streaming_state(False)
+        socketio.sleep(backoff)
+        backoff = min(backoff * 2, 10.0)
+
+def relay_worker_main(index, ring_name, notify, controls, host, port, profile,
+                      queue_policy, max_lag_seconds):
+    """عملية نقل: خادم Flask-SocketIO كامل يقرأ الصوت من الذاكرة المشتركة"""
+    global control_queue, socket_client_options
+    control_queue = controls
+    apply_latency_profile(profile)
+    apply_queue_policy(queue_policy, max_lag_seconds)
+    # طلبات الاستطلاع (polling) قد تصل لعملية أخرى على المنفذ المشترك
+    socket_client_options = {'transports': ['websocket']}
+    ring = SharedAudioRing(name=ring_name)
+    fanout_pool.start()
+    socketio.start_background_task(shared_ring_reader, ring, notify)
+    print(f"🔁 عملية النقل {index} (pid {os.getpid()}) على المنفذ {port}")
+    try:
+        run_server(host, port, reuse_port=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+def run_multiprocess(workers, host, port):
+    """عملية الالتقاط والمعالجة تنشر في ذاكرة مشتركة، و N عملية نقل تخدم المستمعين"""
+    context = multiprocessing.get_context('spawn')
+    ring = SharedAudioRing(create=True)
+    notify = context.Condition()
+    controls = context.Queue()
+
+    def publish_shared(chunk, captured_at):
+        ring.write(chunk, captured_at)
+        with notify:
+            notify.notify_all()
+
+    audio_processor.sinks.append(publish_shared)
+    processes = [context.Process(target=relay_worker_main, daemon=True,
+                                 args=(i, ring.name, notify, controls, host, port, latency_profile,
+                                       LISTENER_QUEUE_POLICY, LISTENER_MAX_LAG_SECONDS))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+
+    def set_active(active):
+        if active and not audio_processor.is_recording:
+            active = audio_processor.start_recording()
+        elif not active:
+            audio_processor.stop_recording()
+        ring.set_active(active)
+        with notify:
+            notify.notify_all()
+        print("تم بدء البث" if active else "تم إيقاف البث")
+
+    # البث يبدأ فوراً في هذا الوضع؛ أحداث التحكم تصل من عمليات النقل
+    set_active(True)
+    try:
+        while True:
+            event, data = controls.get()
+            if event in ('start_stream', 'stop_stream'):
+                set_active(event == 'start_stream')
+            elif event in CONTROL_HANDLERS:
+                CONTROL_HANDLERS[event](data)
+    except KeyboardInterrupt:
+        print("\n🛑 إيقاف الخادم...")
+    finally:
+        audio_processor.stop_recording()
+        if archive_writer:
+            archive_writer.stop()
+        for process in processes:
+            process.terminate()
+        ring.close()
+
+def print_public_urls(port, info):
+    print(f"🌐 الخادم العام: http://{info['public_ip']}:{port}")
+    print(f"🎧 رابط الاستماع العام: http://{info['public_ip']}:{port}/listen")
+
+def print_server_info(port=5000):
     """طباعة معلومات الخادم"""
     print("\n" + "="*60)
     print("🎙️  إذاعة صوتية احترافية - Professional Radio Streaming")
     print("="*60)
     
+    # العنوان المحلي لا يحتاج الشبكة؛ العنوان العام يُطبع عند وصوله من الخلفية
+    network_manager.resolve('local_ip')
     local_ip = network_manager.get_local_ip()
-    public_ip = network_manager.get_public_ip()
-    port = 5000
+    network_manager.on_update = lambda info: print_public_urls(port, info)
     
     print(f"📡 الخادم المحلي: http://{local_ip}:{port}")
-    print(f"🌐 الخادم العام: http://{public_ip}:{port}")
     print(f"🎧 رابط الاستماع المحلي: http://{local_ip}:{port}/listen")
-    print(f"🎧 رابط الاستماع العام: http://{public_ip}:{port}/listen")
+    print(f"📻 بث HTTP مباشر (VLC وغيره): http://{local_ip}:{port}/stream.wav")
+    print(f"📼 قائمة HLS: http://{local_ip}:{port}/hls/live.m3u8")
     print(f"📊 معلومات الخادم: http://{local_ip}:{port}/status")
+    for name in stations:
+        if name != MAIN_STATION:
+            print(f"📻 محطة {name}: http://{local_ip}:{port}/listen/{name} (التحكم: /admin/{name})")
     print("\n💡 نصائح:")
     print("   - استخدم الرابط العام للوصول من أي مكان")
-    print("   - تأكد من فتح المنفذ 5000 في جدار الحماية")
+    print(f"   - تأكد من فتح المنفذ {port} في جدار الحماية")
     print("   - للأفضل أداء، استخدم سماعات أذن لتجنب الصدى")
     print("="*60)
 
-def setup_audio_requirements():
+def setup_audio_requirements(needs_mic=True):
     """التحقق من متطلبات الصوت"""
     try:
-        import pyaudio
         import numpy as np
         import scipy.signal
-        import noisereduce as nr
-        print("✅ جميع مكتبات الصوت متوفرة")
-        return True
     except ImportError as e:
         print(f"❌ مكتبة مفقودة: {e}")
         print("💡 قم بتثبيت المكتبات المطلوبة:")
-        print("   pip install pyaudio numpy scipy noisereduce")
+        print("   pip install numpy scipy")
+        return False
+    if needs_mic and pyaudio is None:
+        print("❌ مكتبة مفقودة: pyaudio (مطلوبة للميكروفون)")
+        print("💡 ثبّتها أو اختر مصدراً آخر: --source tone | wav:PATH | stdin")
         return False
+    print("✅ جميع مكتبات الصوت متوفرة")
+    return True
+
+def create_station(spec, realtime=True):
+    """محطة إضافية من وصف NAME=SOURCE (مثل jazz=wav:jazz.wav) بإعدادات الملف الحالي"""
+    name, _, source_spec = spec.partition('=')
+    if not name or not name.replace('-', '').replace('_', '').isalnum() or not source_spec:
+        raise ValueError(f"وصف محطة غير صالح: {spec} (الصيغة NAME=SOURCE)")
+    if name in stations:
+        raise ValueError(f"المحطة موجودة مسبقاً: {name}")
+    processor = AudioProcessor(create_source(source_spec, realtime))
+    processor.configure(RATE, CHUNK, LATENCY_PROFILES[latency_profile]['queue'])
+    return add_station(name, processor)
+
+def start_archive(args):
+    global archive_writer
+    archive_writer = ArchiveWriter(
+        args.archive, segment_seconds=args.archive_segment,
+        max_bytes=int(args.archive_max_gb * 1024**3) if args.archive_max_gb else None,
+        max_age_seconds=args.archive_max_days * 86400 if args.archive_max_days else None)
+    archive_writer.start()
+    audio_processor.sinks.append(archive_writer)
+    print(f"🗄️ أرشفة البث في: {args.archive}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="إذاعة صوتية احترافية")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=0,
+                        help="عدد عمليات النقل التي تتشارك المنفذ (0 = عملية واحدة)")
+    parser.add_argument('--relay', metavar='URL',
+                        help="وضع الترحيل: إعادة بث خادم أصلي دون فتح جهاز صوت")
+    parser.add_argument('--profile', choices=sorted(LATENCY_PROFILES), default=DEFAULT_LATENCY_PROFILE,
+                        help="ملف زمن الوصول: حجم الكتلة ومعدل العينة وأعماق الطوابير")
+    parser.add_argument('--queue-policy', choices=QUEUE_POLICIES, default=LISTENER_QUEUE_POLICY,
+                        help="سياسة طابور المستمع البطيء: إسقاط الأقدم أو القفز إلى البث الحي أو الفصل")
+    parser.add_argument('--max-lag', type=float, default=LISTENER_MAX_LAG_SECONDS,
+                        help="ثواني التأخر التي يُفصل بعدها المستمع في سياسة disconnect")
+    parser.add_argument('--source', default='mic',
+                        help="مصدر الصوت: mic | tone[:freq] | noise[:level] | wav:PATH | stdin | pipe:PATH")
+    parser.add_argument('--station', action='append', default=[], metavar='NAME=SOURCE',
+                        help="محطة إضافية بمصدرها الخاص على /listen/NAME (يمكن تكرارها)")
+    parser.add_argument('--archive', metavar='DIR', help="أرشفة البث في ملفات WAV داخل هذا المجلد")
+    parser.add_argument('--archive-segment', type=float, default=3600,
+                        help="مدة ملف الأرشيف الواحد بالثواني")
+    parser.add_argument('--archive-max-gb', type=float, help="حذف أقدم الملفات عند تجاوز هذا الحجم")
+    parser.add_argument('--archive-max-days', type=float, help="حذف الملفات الأقدم من هذه المدة")
+    parser.add_argument('--fast', action='store_true',
+                        help="قراءة الملف/المولد بأقصى سرعة بدل الزمن الحقيقي (لاختبارات الحمل)")
+    return parser.parse_args()
 
 def main():
     """الدالة الرئيسية"""
+    args = parse_args()
+    port = args.port
     print("🚀 بدء تشغيل الخادم...")
     
+    apply_latency_profile(args.profile)
+    print(f"⏱️ ملف زمن الوصول: {args.profile} ({CHUNK} عينة @ {RATE} Hz)")
+    apply_queue_policy(args.queue_policy, args.max_lag)
+    print(f"🚦 سياسة طوابير المستمعين: {args.queue_policy}")
+    
+    if not args.relay:
+        try:
+            audio_processor.source = create_source(args.source, realtime=not args.fast)
+        except (ValueError, OSError) as e:
+            print(f"❌ {e}")
+            return
+        print(f"🎚️ مصدر الصوت: {args.source}")
+    
+    if args.station and (args.relay or args.workers > 0):
+        print("❌ المحطات الإضافية متاحة في وضع العملية الواحدة فقط")
+        return
+    for spec in args.station:
+        try:
+            station = create_station(spec, realtime=not args.fast)
+        except (ValueError, OSError) as e:
+            print(f"❌ {e}")
+            return
+        print(f"📻 محطة {station.name}: {station.processor.source.name}")
+    
     # التحقق من المتطلبات
-    if not setup_audio_requirements():
+    needs_mic = not args.relay and any(isinstance(station.processor.source, PyAudioSource)
+                                       for station in stations.values())
+    if not setup_audio_requirements(needs_mic):
         print("❌ فشل في التحقق من المتطلبات")
         return
     
     # طباعة معلومات الخادم
-    print_server_info()
+    print_server_info(port)
     
-    # بدء خيط البث الصوتي
-    audio_thread = threading.Thread(target=audio_streaming_thread, daemon=True)
-    audio_thread.start()
-    print("🎵 تم بدء خيط البث الصوتي")
+    if args.archive:
+        start_archive(args)
+    
+    if args.workers > 0:
+        print(f"🧩 وضع العمليات المتعددة: {args.workers} عملية نقل")
+        run_multiprocess(args.workers, args.host, port)
+        return
+    
+    # بدء عمال التوزيع المشتركين بين المحطات
+    fanout_pool.start()
+    print(f"🎵 تم بدء خيوط البث الصوتي ({fanout_pool.workers} عمال لـ {len(stations)} محطة)")
+    
+    if args.relay:
+        print(f"🔁 وضع الترحيل من: {args.relay}")
+        socketio.start_background_task(relay_client, args.relay)
     
     try:
         # تشغيل الخادم
-        print("🌐 تشغيل خادم الويب...")
-        socketio.run(app, host='0.0.0.0', port=5000, debug=False, allow_unsafe_werkzeug=True)
+        print(f"🌐 تشغيل خادم الويب ({ASYNC_MODE})...")
+        run_server(args.host, port)
     except KeyboardInterrupt:
         print("\n🛑 إيقاف الخادم...")
-        audio_processor.stop_recording()
+        for station in stations.values():
+            station.processor.stop_recording()
         print("✅ تم إيقاف الخادم بنجاح")
     except Exception as e:
         print(f"❌ خطأ في تشغيل الخادم: {e}")
-        print("💡 تأكد من أن المنفذ 5000 غير مستخدم")
+        print(f"💡 تأكد من أن المنفذ {port} غير مستخدم")
+    finally:
+        if archive_writer:
+            archive_writer.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,56 @@
+"""ذهاب وإياب لترميزات السلك: الطول محفوظ والجودة فوق حد ثابت"""
+import numpy as np
+import pytest
+
+import main
+
+
+def tone(amplitude, count=4000, rate=16000, frequency=440):
+    t = np.arange(count) / rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+
+
+def snr_db(reference, decoded):
+    reference = reference.astype(np.float64)
+    error = reference - decoded.astype(np.float64)
+    return 10 * np.log10(np.sum(reference ** 2) / np.sum(error ** 2))
+
+
+def test_pcm16_is_lossless():
+    pcm = tone(20000)
+    codec = main.CODECS['pcm16']
+    assert np.array_equal(codec.decode(codec.encode(pcm.tobytes())), pcm)
+
+
+@pytest.mark.parametrize('name', ['mulaw', 'adpcm'])
+@pytest.mark.parametrize('amplitude', [2000, 20000])
+def test_lossy_round_trip_snr(name, amplitude):
+    pcm = tone(amplitude)
+    codec = main.CODECS[name]
+    decoded = codec.decode(codec.encode(pcm.tobytes()))
+    assert decoded.dtype == np.int16
+    assert len(decoded) == len(pcm)
+    assert snr_db(pcm, decoded) > 30
+
+
+@pytest.mark.parametrize('count', [1, 127, 128, 129, 512])
+def test_adpcm_keeps_length_of_partial_blocks(count):
+    codec = main.CODECS['adpcm']
+    pcm = tone(8000, count)
+    payload = codec.encode(pcm.tobytes())
+    blocks = -(-count // codec.BLOCK)
+    assert len(payload) == 4 + blocks * (4 + codec.BLOCK // 2)
+    assert len(codec.decode(payload)) == count
+
+
+def test_adpcm_survives_full_scale_jumps():
+    pcm = np.tile(np.array([32767, -32768], dtype=np.int16), 256)
+    codec = main.CODECS['adpcm']
+    decoded = codec.decode(codec.encode(pcm.tobytes()))
+    assert len(decoded) == len(pcm)
+    assert decoded[0] == 32767
+
+
+def test_mulaw_is_two_to_one():
+    pcm = tone(20000)
+    assert len(main.CODECS['mulaw'].encode(pcm.tobytes())) == len(pcm)
@@ -0,0 +1,31 @@
+"""StreamingFilter: الحالة المحمولة بين الكتل تطابق sosfilt واحداً على الإشارة كاملة"""
+import numpy as np
+import pytest
+from scipy.signal import sosfilt, sosfilt_zi
+
+import main
+
+SPLITS = [0, 1, 100, 1024, 1500, 4096, 6000]
+
+
+def signal(count=6000):
+    return np.random.default_rng(1).standard_normal(count) * 1000 + 300
+
+
+@pytest.mark.parametrize('cutoff,btype', [(3000, 'low'), (300, 'high')])
+def test_chunks_match_whole_signal_sosfilt(cutoff, btype):
+    x = signal()
+    stage = main.StreamingFilter(4, cutoff, btype, rate=22050)
+    chunks = [stage.process(x[start:end]) for start, end in zip(SPLITS, SPLITS[1:])]
+    # الحالة الأولى تُهيأ من أول عينة كما في المرحلة
+    expected, _ = sosfilt(stage.sos, x, zi=sosfilt_zi(stage.sos) * x[0])
+    np.testing.assert_allclose(np.concatenate(chunks), expected, rtol=1e-10, atol=1e-9)
+
+
+def test_reset_starts_from_next_chunk():
+    x = signal()
+    stage = main.StreamingFilter(4, 3000, 'low', rate=22050)
+    stage.process(x[:1000])
+    stage.reset()
+    expected, _ = sosfilt(stage.sos, x[1000:], zi=sosfilt_zi(stage.sos) * x[1000])
+    np.testing.assert_allclose(stage.process(x[1000:]), expected, rtol=1e-10, atol=1e-9)
@@ -0,0 +1,36 @@
+"""NetworkManager بمحللات محقونة: لا يحتاج شبكة"""
+import main
+
+
+def offline():
+    raise OSError("لا توجد شبكة")
+
+
+def test_offline_boot_retries_after_short_interval():
+    answers = iter([offline, lambda: '203.0.113.7'])
+    manager = main.NetworkManager(public_ip_resolver=lambda: next(answers)(),
+                                  local_ip_resolver=lambda: '10.0.0.2',
+                                  ttl=600, retry_interval=30)
+    manager.refresh()
+    assert manager.values['public_ip'] == "غير متاح"
+    assert manager.failed == {'public_ip'}
+    assert manager.expires_at - main.time.time() <= 30
+
+    # عودة الشبكة: التحديث التالي يحل العنوان ويعود إلى ttl الكاملة
+    updates = []
+    manager.on_update = updates.append
+    manager.refresh()
+    assert manager.values['public_ip'] == '203.0.113.7'
+    assert not manager.failed
+    assert manager.expires_at - main.time.time() > 30
+    assert updates == [{'public_ip': '203.0.113.7', 'local_ip': '10.0.0.2'}]
+
+
+def test_failure_keeps_last_known_value():
+    manager = main.NetworkManager(public_ip_resolver=lambda: '203.0.113.7',
+                                  local_ip_resolver=lambda: '10.0.0.2')
+    manager.refresh()
+    manager.resolvers['public_ip'] = offline
+    manager.refresh()
+    assert manager.values['public_ip'] == '203.0.113.7'
+    assert manager.expires_at - main.time.time() <= manager.retry_interval
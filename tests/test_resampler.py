@@ -0,0 +1,42 @@
+"""StreamingResampler: تقسيم الإشارة إلى كتل لا يغير الخرج ويطابق upfirdn"""
+import numpy as np
+import pytest
+from scipy.signal import upfirdn
+
+import main
+
+RATE_PAIRS = [(22050, 8000), (22050, 16000), (22050, 44100), (16000, 16000)]
+SPLITS = [0, 1, 130, 1024, 1025, 3000, 5000]
+
+
+def signal(count=5000):
+    return np.random.default_rng(0).standard_normal(count)
+
+
+@pytest.mark.parametrize('from_rate,to_rate', RATE_PAIRS)
+def test_matches_one_shot_upfirdn(from_rate, to_rate):
+    resampler = main.StreamingResampler(from_rate, to_rate)
+    # إعادة بناء المرشح الكامل من أطواره المعكوسة
+    h = resampler.phases[:, ::-1].T.ravel()
+    x = signal()
+    out = resampler.process(x)
+    expected = upfirdn(h, x, resampler.up, resampler.down)[:len(out)]
+    assert len(out) == -(-len(x) * resampler.up // resampler.down)
+    np.testing.assert_allclose(out, expected, atol=1e-12)
+
+
+@pytest.mark.parametrize('from_rate,to_rate', RATE_PAIRS)
+def test_chunk_split_invariance(from_rate, to_rate):
+    x = signal()
+    whole = main.StreamingResampler(from_rate, to_rate).process(x)
+    resampler = main.StreamingResampler(from_rate, to_rate)
+    chunks = [resampler.process(x[start:end]) for start, end in zip(SPLITS, SPLITS[1:])]
+    np.testing.assert_array_equal(np.concatenate(chunks), whole)
+
+
+def test_reset_restarts_from_silence():
+    x = signal()
+    resampler = main.StreamingResampler(22050, 16000)
+    first = resampler.process(x)
+    resampler.reset()
+    np.testing.assert_array_equal(resampler.process(x), first)